@@ -0,0 +1,1620 @@
+# Historial de chats, adjuntos y cachés en disco, sin nada de Streamlit: lo usan
+# la app (main.py) y las herramientas de línea de comandos (herramientas.py,
+# analitica.py).
+#
+# Importarlo no crea archivos ni hilos: cada almacén se abre la primera vez que
+# se pide (ver recurso_del_proceso) y recién ahí crea su carpeta dentro de
+# CHATS_DIR. Las funciones del historial lanzan excepciones en lugar de mostrar
+# errores; la app decide cómo avisarlos.
+import atexit
+import functools
+import gzip
+import hashlib
+import json
+import logging
+import lzma
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+import zipfile
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from extractores import obtener_extractor
+
+# Configuración de directorio para historial de chats
+CHATS_DIR = "chat_history"
+
+# Almacenamiento de chats: "sqlite" (una base embebida) o "json" (archivos por chat)
+BACKEND_CHATS = "sqlite"
+DB_CHATS = os.path.join(CHATS_DIR, "chats.db")
+
+# Texto extraído de los adjuntos, guardado una sola vez por contenido (sha256 del archivo)
+ADJUNTOS_DIR = os.path.join(CHATS_DIR, "adjuntos")
+
+# Caché del texto extraído de los archivos subidos, por hash del contenido:
+# un nivel en memoria (LRU) y otro en disco que se recorta por tamaño
+CACHE_EXTRACCION_DIR = os.path.join(CHATS_DIR, ".cache_extraccion")
+CACHE_MEMORIA_BYTES = 64 * 1024 * 1024
+CACHE_DISCO_BYTES = 512 * 1024 * 1024
+
+# Caché de respuestas para pedidos idénticos: dónde se guarda, cuánto dura cada
+# respuesta y cuántas se tienen en memoria
+DB_CACHE_RESPUESTAS = os.path.join(CHATS_DIR, ".cache_respuestas.db")
+CACHE_RESPUESTAS_TTL_SEG = 7 * 24 * 3600
+CACHE_RESPUESTAS_MEMORIA = 256
+
+# Importación masiva: hilos que leen y validan el zip y chats por transacción
+IMPORTACION_HILOS = 4
+IMPORTACION_LOTE = 200
+
+# Los guardados de un mismo chat dentro de esta ventana se agrupan en una escritura
+ESPERA_ESCRITURA_SEG = 0.5
+
+# Los chats sin actividad durante más de estos días se guardan comprimidos
+DIAS_PARA_ARCHIVAR = 30
+# Compresor de la biblioteca estándar para los chats archivados: "gzip" o "lzma"
+COMPRESION_ARCHIVO = "gzip"
+COMPRESORES = {
+    "gzip": (".gz", lambda datos: gzip.compress(datos, compresslevel=6, mtime=0), gzip.decompress),
+    "lzma": (".xz", lzma.compress, lzma.decompress)
+}
+
+# Búsqueda de texto completo (FTS5): sin distinguir mayúsculas ni acentos
+TOKENIZADOR_FTS = "unicode61 remove_diacritics 2"
+PALABRAS_FRAGMENTO = 12
+
+logger = logging.getLogger(__name__)
+
+def recurso_del_proceso(funcion):
+    """Crea el resultado de `funcion` una sola vez por proceso, aunque la pidan varios hilos a la vez.
+    
+    Cumple el papel de @st.cache_resource para los almacenes, que también se usan
+    fuera de Streamlit.
+    """
+    candado = threading.Lock()
+    recurso = []
+
+    @functools.wraps(funcion)
+    def obtener():
+        if not recurso:
+            with candado:
+                if not recurso:
+                    recurso.append(funcion())
+        return recurso[0]
+
+    return obtener
+
+# ==================== FUNCIONES PARA HISTORIAL DE CHATS ====================
+
+def generar_nombre_por_defecto(mensajes):
+    """Reserva un nombre para el chat basado en un resumen de los primeros mensajes"""
+    try:
+        # Obtener los primeros 5 mensajes del usuario
+        mensajes_usuario = [m["content"] for m in mensajes if m["role"] == "user"][:5]
+        
+        # Crear un texto base combinando los mensajes
+        texto_completo = " ".join(mensajes_usuario)
+        
+        # Generar un resumen de máximo 6 palabras
+        palabras = texto_completo.split()[:6]
+        resumen = " ".join(palabras).lower()
+        
+        # Limpiar el texto para nombre de archivo
+        caracteres_permitidos = "abcdefghijklmnopqrstuvwxyz0123456789"
+        texto_limpio = "".join(c if c.lower() in caracteres_permitidos else "_" for c in resumen)
+        texto_limpio = texto_limpio.strip("_").replace("__", "_")
+        
+        # Si no hay contenido válido, usar 'chat'
+        if not texto_limpio or len(texto_limpio) < 3:
+            texto_limpio = "chat"
+        
+        return reservar_nombre_chat(texto_limpio)
+        
+    except Exception:
+        # Fallback con timestamp si hay algún error
+        return f"chat_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+
+def reservar_nombre_chat(base):
+    """Reserva el primer nombre libre de la secuencia base, base_01, base_02, ...
+    
+    La reserva es atómica, así dos sesiones nunca reciben el mismo nombre.
+    """
+    if BACKEND_CHATS == "sqlite":
+        return obtener_almacen().reservar_nombre(base)
+    return _json_reservar_nombre(base)
+
+def nombre_en_secuencia(base, numero):
+    """Nombre número `numero` de la secuencia de una base: base, base_01, base_02, ..."""
+    return base if numero == 0 else f"{base}_{numero:02d}"
+
+def normalizar_nombre_chat(nombre_chat):
+    """Limpia el nombre de un chat para usarlo como clave de almacenamiento"""
+    nombre_valido = "".join(c if c.isalnum() or c in " -_." else "_" for c in nombre_chat)
+    nombre_valido = nombre_valido.strip()
+    if nombre_valido.lower().endswith('.json'):
+        nombre_valido = nombre_valido[:-5]
+    return nombre_valido
+
+def guardar_chat(nombre_chat, mensajes, en_segundo_plano=False):
+    """Guarda el chat actual (en SQLite solo se agregan los mensajes nuevos).
+    
+    Con en_segundo_plano=True solo se encola: la escritura la hace el hilo del
+    EscritorChats, que agrupa varios guardados seguidos del mismo chat, y su error
+    queda en obtener_escritor().tomar_error(). Si no, el error se lanza acá.
+    """
+    # Asegurarse de que el nombre no tenga caracteres inválidos
+    nombre_valido = normalizar_nombre_chat(nombre_chat)
+    
+    if not nombre_valido:
+        nombre_valido = generar_nombre_por_defecto(mensajes)
+    
+    escritor = obtener_escritor()
+    escritor.encolar(nombre_valido, mensajes)
+    if not en_segundo_plano:
+        # Pasa por la misma cola para no quedar pisado por un guardado anterior pendiente
+        escritor.vaciar(nombre_valido)
+        error = escritor.tomar_error(nombre_valido)
+        if error:
+            raise error
+
+def _guardar_en_backend(nombre_chat, mensajes):
+    if BACKEND_CHATS == "sqlite":
+        obtener_almacen().guardar(nombre_chat, mensajes)
+    else:
+        _json_guardar_chat(nombre_chat, mensajes)
+
+def cargar_chat(nombre_chat):
+    """Carga un chat guardado; devuelve None si no existe"""
+    obtener_escritor().vaciar(nombre_chat)
+    try:
+        if BACKEND_CHATS == "sqlite":
+            return obtener_almacen().cargar(nombre_chat)
+        return _json_cargar_chat(nombre_chat)
+    except FileNotFoundError:
+        return None
+
+def listar_chats(limite=None, desplazamiento=0):
+    """Lista los chats guardados, del de actividad más reciente al más antiguo"""
+    return [chat["nombre"] for chat in listar_chats_detalle(limite, desplazamiento)]
+
+def listar_chats_detalle(limite=None, desplazamiento=0):
+    """Devuelve los metadatos de una página de chats sin abrir ninguno de ellos"""
+    if BACKEND_CHATS == "sqlite":
+        return obtener_almacen().listar(limite, desplazamiento)
+    chats = sorted((c for c in _manifiesto_vigente().values() if c["mensajes"]),
+                   key=lambda c: c["ultimo_ts"], reverse=True)
+    fin = None if limite is None else desplazamiento + limite
+    return chats[desplazamiento:fin]
+
+def contar_chats():
+    """Cantidad de chats guardados"""
+    if BACKEND_CHATS == "sqlite":
+        return obtener_almacen().contar()
+    return sum(1 for c in _manifiesto_vigente().values() if c["mensajes"])
+
+def buscar_chats(texto, limite=20):
+    """Busca en el contenido de todos los chats; devuelve los más relevantes con un fragmento"""
+    consulta = _consulta_fts(texto)
+    if not consulta:
+        return []
+    # Se piden varios mensajes por chat para poder quedarse con el mejor de cada uno
+    if BACKEND_CHATS == "sqlite":
+        filas = obtener_almacen().buscar(consulta, limite * 5)
+    else:
+        manifiesto = _manifiesto_vigente()
+        filas = [
+            {**manifiesto[f["chat"]], "fragmento": f["fragmento"]}
+            for f in obtener_indice_busqueda().buscar(consulta, limite * 5)
+            if f["chat"] in manifiesto
+        ]
+    resultados = {}
+    for fila in filas:
+        if fila["nombre"] not in resultados:
+            resultados[fila["nombre"]] = {
+                "nombre": fila["nombre"],
+                "titulo": fila["titulo"],
+                "ultimo_ts": fila["ultimo_ts"],
+                "fragmento": fila["fragmento"]
+            }
+    return list(resultados.values())[:limite]
+
+def _consulta_fts(texto):
+    """Convierte el texto del usuario en una consulta FTS5: todas las palabras, como prefijos"""
+    return " ".join(f'"{palabra}"*' for palabra in re.findall(r"\w+", texto))
+
+def archivar_chats_inactivos(dias=DIAS_PARA_ARCHIVAR, compresion=COMPRESION_ARCHIVO):
+    """Comprime los chats sin actividad desde hace `dias` días y devuelve cuántos se archivaron.
+    
+    Los ya archivados con otro compresor se recomprimen con `compresion`;
+    cargar_chat los descomprime sin que quien llama lo note.
+    """
+    obtener_escritor().vaciar()
+    limite = datetime.now() - timedelta(days=dias)
+    if BACKEND_CHATS == "sqlite":
+        return obtener_almacen().archivar(limite.isoformat(), compresion)
+    return _json_archivar_chats(limite.timestamp() * 1e9, compresion)
+
+def _archivar_en_segundo_plano():
+    try:
+        archivados = archivar_chats_inactivos()
+        if archivados:
+            logger.info("Chats inactivos archivados: %s", archivados)
+        comprimidos = comprimir_adjuntos()
+        if comprimidos:
+            logger.info("Adjuntos comprimidos: %s", comprimidos)
+    except Exception:
+        logger.exception("No se pudieron archivar los chats inactivos")
+
+@recurso_del_proceso
+def programar_archivado():
+    """Archiva los chats inactivos y comprime los adjuntos viejos una vez por proceso, sin demorar al primer usuario"""
+    return _estado_journal().compactador.submit(_archivar_en_segundo_plano)
+
+def resumir_chat(mensajes):
+    """Metadatos que se guardan junto a cada chat para listarlo sin cargarlo"""
+    primer_mensaje = next((m["content"] for m in mensajes if m["role"] == "user"), "")
+    timestamps = [m["timestamp"] for m in mensajes if m.get("timestamp")]
+    return {
+        "titulo": primer_mensaje.strip().split("\n", 1)[0][:60],
+        "mensajes": len(mensajes),
+        "modelos": sorted({m["model"] for m in mensajes if m.get("model")}),
+        "primer_ts": min(timestamps, default=None),
+        "ultimo_ts": max(timestamps, default=None),
+        "bytes": sum(len(m["content"].encode("utf-8")) for m in mensajes)
+    }
+
+def eliminar_chat(nombre_chat):
+    """Elimina un chat guardado; lanza FileNotFoundError si no existe"""
+    obtener_escritor().descartar(nombre_chat)
+    if BACKEND_CHATS == "sqlite":
+        obtener_almacen().eliminar(nombre_chat)
+    else:
+        _json_eliminar_chat(nombre_chat)
+
+# ==================== ESCRITURA EN SEGUNDO PLANO ====================
+
+class EscritorChats:
+    """Hilo que persiste los chats fuera del hilo del script de Streamlit.
+    
+    Guarda solo la última versión encolada de cada chat: los pedidos que llegan
+    dentro de ESPERA_ESCRITURA_SEG se agrupan en una única escritura.
+    """
+
+    def __init__(self):
+        self._condicion = threading.Condition()
+        self._pendientes = {}       # nombre -> última lista de mensajes encolada
+        self._escribiendo = set()
+        self._errores = {}          # nombre -> excepción de la última escritura fallida
+        self._urgente = False
+        self._activo = True
+        self._hilo = threading.Thread(target=self._ejecutar, name="escritor-chats", daemon=True)
+        self._hilo.start()
+
+    def encolar(self, nombre_chat, mensajes):
+        with self._condicion:
+            # Copia superficial: el script sigue agregando mensajes a la lista original
+            self._pendientes[nombre_chat] = list(mensajes)
+            self._condicion.notify_all()
+
+    def vaciar(self, nombre_chat=None, timeout=None):
+        """Espera a que se escriban los pendientes de un chat (o de todos)"""
+        def listo():
+            if nombre_chat is None:
+                return not self._pendientes and not self._escribiendo
+            return nombre_chat not in self._pendientes and nombre_chat not in self._escribiendo
+        with self._condicion:
+            if not listo():
+                self._urgente = True
+                self._condicion.notify_all()
+            return self._condicion.wait_for(listo, timeout)
+
+    def descartar(self, nombre_chat):
+        """Olvida lo pendiente de un chat (por ejemplo, porque se va a eliminar)"""
+        with self._condicion:
+            self._pendientes.pop(nombre_chat, None)
+            self._condicion.wait_for(lambda: nombre_chat not in self._escribiendo)
+            self._errores.pop(nombre_chat, None)
+
+    def tomar_error(self, nombre_chat):
+        with self._condicion:
+            return self._errores.pop(nombre_chat, None)
+
+    def detener(self):
+        """Escribe todo lo pendiente y termina el hilo (se registra con atexit)"""
+        with self._condicion:
+            self._activo = False
+            self._condicion.notify_all()
+        self._hilo.join()
+
+    def _ejecutar(self):
+        while True:
+            with self._condicion:
+                self._condicion.wait_for(lambda: self._pendientes or not self._activo)
+                if not self._pendientes:
+                    return
+                # Ventana para agrupar guardados seguidos, salvo que alguien esté esperando
+                self._condicion.wait_for(lambda: self._urgente or not self._activo, ESPERA_ESCRITURA_SEG)
+                lote, self._pendientes = self._pendientes, {}
+                self._escribiendo = set(lote)
+                self._urgente = False
+            for nombre_chat, mensajes in lote.items():
+                try:
+                    _guardar_en_backend(nombre_chat, mensajes)
+                    error = None
+                except Exception as e:
+                    logger.exception("No se pudo guardar el chat %s", nombre_chat)
+                    error = e
+                with self._condicion:
+                    if error:
+                        self._errores[nombre_chat] = error
+                    else:
+                        self._errores.pop(nombre_chat, None)
+                    self._escribiendo.discard(nombre_chat)
+                    self._condicion.notify_all()
+
+@recurso_del_proceso
+def obtener_escritor():
+    escritor = EscritorChats()
+    atexit.register(escritor.detener)
+    return escritor
+
+# ==================== BACKEND JSON (SNAPSHOT + JOURNAL) ====================
+
+# Cada chat es un snapshot <nombre>.json (lista de mensajes) más un journal
+# <nombre>.jsonl con una línea {"i": posición, "m": mensaje} por mensaje nuevo.
+# Cuando el journal supera este tamaño se compacta en segundo plano.
+JOURNAL_MAX_BYTES = 256 * 1024
+
+def _ruta_snapshot(nombre_chat):
+    return os.path.join(CHATS_DIR, f"{nombre_chat}.json")
+
+def _ruta_journal(nombre_chat):
+    return os.path.join(CHATS_DIR, f"{nombre_chat}.jsonl")
+
+def _rutas_archivado(nombre_chat):
+    """Snapshot comprimido de un chat archivado, uno por compresor posible"""
+    return {compresion: _ruta_snapshot(nombre_chat) + sufijo
+            for compresion, (sufijo, _, _) in COMPRESORES.items()}
+
+SUFIJOS_CHAT = (".json", ".jsonl") + tuple(f".json{sufijo}" for sufijo, _, _ in COMPRESORES.values())
+
+class _EstadoJournal:
+    """Candados por chat y mensajes ya persistidos, compartidos entre reruns"""
+
+    def __init__(self):
+        self._candado = threading.Lock()
+        self._candados_chat = {}
+        # nombre -> (cantidad de mensajes, último mensaje, firma de los archivos)
+        self.persistidos = {}
+        self.compactador = ThreadPoolExecutor(max_workers=1, thread_name_prefix="compactar-chats")
+        self.candado_secuencias = threading.Lock()
+
+    def candado_chat(self, nombre_chat):
+        with self._candado:
+            return self._candados_chat.setdefault(nombre_chat, threading.Lock())
+
+@recurso_del_proceso
+def _estado_journal():
+    # Toda escritura del backend JSON pasa por acá antes de tocar CHATS_DIR
+    os.makedirs(CHATS_DIR, exist_ok=True)
+    return _EstadoJournal()
+
+def _firma_archivos_chat(nombre_chat):
+    """Tamaño y fecha de snapshot, journal y archivados, para detectar cambios de otro proceso"""
+    firma = []
+    for ruta in (_ruta_snapshot(nombre_chat), _ruta_journal(nombre_chat), *_rutas_archivado(nombre_chat).values()):
+        try:
+            info = os.stat(ruta)
+            firma.append((info.st_size, info.st_mtime_ns))
+        except FileNotFoundError:
+            firma.append(None)
+    return tuple(firma)
+
+def escribir_atomico(ruta, datos):
+    """Escribe en un temporal del mismo directorio, hace fsync y lo renombra sobre `ruta`.
+    
+    Una caída a mitad de camino deja el archivo anterior intacto, nunca uno cortado.
+    """
+    directorio = os.path.dirname(ruta)
+    if isinstance(datos, str):
+        datos = datos.encode("utf-8")
+    with tempfile.NamedTemporaryFile("wb", dir=directorio, suffix=".tmp", delete=False) as f:
+        try:
+            f.write(datos)
+            f.flush()
+            os.fsync(f.fileno())
+        except BaseException:
+            f.close()
+            os.unlink(f.name)
+            raise
+    os.replace(f.name, ruta)
+    _fsync_directorio(directorio)
+
+def _fsync_directorio(directorio):
+    # Hace durable el rename; en Windows no se pueden abrir directorios
+    if hasattr(os, "O_DIRECTORY"):
+        fd = os.open(directorio, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+def _escribir_snapshot(nombre_chat, mensajes):
+    escribir_atomico(_ruta_snapshot(nombre_chat),
+                      json.dumps(mensajes, ensure_ascii=False, separators=(",", ":")))
+    # Al volver a escribirse el chat deja de estar archivado
+    for ruta in _rutas_archivado(nombre_chat).values():
+        if os.path.exists(ruta):
+            os.remove(ruta)
+
+def _leer_snapshot(nombre_chat):
+    """Lee el snapshot plano o, si el chat está archivado, el comprimido"""
+    try:
+        with open(_ruta_snapshot(nombre_chat), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        pass
+    for compresion, ruta in _rutas_archivado(nombre_chat).items():
+        try:
+            with open(ruta, "rb") as f:
+                return json.loads(COMPRESORES[compresion][2](f.read()))
+        except FileNotFoundError:
+            continue
+    return None
+
+def _leer_chat_json(nombre_chat):
+    mensajes = _leer_snapshot(nombre_chat)
+    existe = mensajes is not None
+    if mensajes is None:
+        mensajes = []
+    try:
+        with open(_ruta_journal(nombre_chat), "r", encoding="utf-8") as f:
+            for linea in f:
+                try:
+                    entrada = json.loads(linea)
+                except json.JSONDecodeError:
+                    break  # Última línea cortada por una caída a mitad de escritura
+                # Las líneas ya incluidas en el snapshot (compactación interrumpida) se ignoran
+                if entrada["i"] == len(mensajes):
+                    mensajes.append(entrada["m"])
+        existe = True
+    except FileNotFoundError:
+        pass
+    if not existe:
+        raise FileNotFoundError(nombre_chat)
+    return mensajes
+
+def _archivar_chat_json(nombre_chat, compresion):
+    """Reemplaza snapshot y journal por un único snapshot comprimido"""
+    sufijo, comprimir, _ = COMPRESORES[compresion]
+    estado = _estado_journal()
+    with estado.candado_chat(nombre_chat):
+        mensajes = _leer_chat_json(nombre_chat)
+        ultima_actividad = max(f[1] for f in _firma_archivos_chat(nombre_chat) if f)
+        destino = _ruta_snapshot(nombre_chat) + sufijo
+        escribir_atomico(destino, comprimir(json.dumps(mensajes, ensure_ascii=False).encode("utf-8")))
+        # Archivar no cuenta como actividad: se conserva la fecha anterior
+        os.utime(destino, ns=(ultima_actividad, ultima_actividad))
+        # El orden deja siempre un estado legible: el plano tiene prioridad al leer
+        # y las líneas del journal ya incluidas en el comprimido se ignoran
+        for ruta in (_ruta_snapshot(nombre_chat), _ruta_journal(nombre_chat), *_rutas_archivado(nombre_chat).values()):
+            if ruta != destino and os.path.exists(ruta):
+                os.remove(ruta)
+        estado.persistidos[nombre_chat] = (len(mensajes), mensajes[-1] if mensajes else None,
+                                           _firma_archivos_chat(nombre_chat))
+        _actualizar_manifiesto(nombre_chat, mensajes)
+
+def _json_archivar_chats(limite_ns, compresion):
+    archivados = 0
+    for nombre_chat, entrada in list(_manifiesto_vigente().items()):
+        if entrada["mtime"] >= limite_ns:
+            continue
+        firma = dict(zip(("plano", "journal", *COMPRESORES), _firma_archivos_chat(nombre_chat)))
+        if firma.pop(compresion) and not any(firma.values()):
+            continue  # Ya archivado con este compresor
+        _archivar_chat_json(nombre_chat, compresion)
+        archivados += 1
+    return archivados
+
+def _reparar_journal(nombre_chat):
+    """Recorta una última línea incompleta para que los nuevos mensajes no se peguen a ella"""
+    try:
+        with open(_ruta_journal(nombre_chat), "rb+") as f:
+            contenido = f.read()
+            if contenido and not contenido.endswith(b"\n"):
+                f.truncate(contenido.rfind(b"\n") + 1)
+    except FileNotFoundError:
+        pass
+
+def _compactar_journal(nombre_chat):
+    """Vuelca el journal en el snapshot; primero el snapshot y después se borra el journal"""
+    estado = _estado_journal()
+    try:
+        with estado.candado_chat(nombre_chat):
+            mensajes = _leer_chat_json(nombre_chat)
+            _escribir_snapshot(nombre_chat, mensajes)
+            os.remove(_ruta_journal(nombre_chat))
+            estado.persistidos[nombre_chat] = (len(mensajes), mensajes[-1] if mensajes else None,
+                                               _firma_archivos_chat(nombre_chat))
+            _actualizar_manifiesto(nombre_chat, mensajes)
+    except FileNotFoundError:
+        pass  # El chat se eliminó mientras la compactación esperaba
+    except Exception as e:
+        logger.warning("No se pudo compactar el chat %s: %s", nombre_chat, e)
+
+# ---------- Manifiesto de chats del backend JSON ----------
+
+# Vive en un subdirectorio para que escribirlo no cambie la fecha de CHATS_DIR
+DIR_INDICE = os.path.join(CHATS_DIR, ".indice")
+RUTA_MANIFIESTO = os.path.join(DIR_INDICE, "manifiesto.json")
+
+class _Manifiesto:
+    """Metadatos de todos los chats del backend JSON, validados por fecha de modificación"""
+
+    def __init__(self):
+        self.candado = threading.RLock()
+        self.chats = {}
+        self.mtime_archivo = None       # Fecha del manifiesto que se leyó o escribió
+        self.mtime_directorio = None    # Fecha de CHATS_DIR cuando el manifiesto estaba al día
+        self.guardado_pendiente = False
+        self.cargado = False
+        self.secuencias = {}            # Próximo número a probar para cada nombre base
+
+@recurso_del_proceso
+def _manifiesto_json():
+    return _Manifiesto()
+
+def _mtime_ns(ruta):
+    try:
+        return os.stat(ruta).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+def _entrada_manifiesto(nombre_chat, mensajes):
+    firma = _firma_archivos_chat(nombre_chat)
+    mtime = max(f[1] for f in firma if f)
+    entrada = resumir_chat(mensajes)
+    entrada["nombre"] = nombre_chat
+    entrada["bytes"] = sum(f[0] for f in firma if f)
+    entrada["mtime"] = mtime
+    if not entrada["ultimo_ts"]:
+        entrada["ultimo_ts"] = datetime.fromtimestamp(mtime / 1e9).isoformat()
+    return entrada
+
+def _actualizar_manifiesto(nombre_chat, mensajes=None):
+    """Actualiza (o quita, si mensajes es None) la entrada de un chat recién escrito"""
+    manifiesto = _manifiesto_json()
+    with manifiesto.candado:
+        if not manifiesto.cargado:
+            _manifiesto_vigente()
+        if mensajes is None:
+            manifiesto.chats.pop(nombre_chat, None)
+        else:
+            manifiesto.chats[nombre_chat] = _entrada_manifiesto(nombre_chat, mensajes)
+        manifiesto.mtime_directorio = _mtime_ns(CHATS_DIR)
+        _programar_guardado_manifiesto(manifiesto)
+
+def _manifiesto_vigente():
+    """Devuelve los chats del manifiesto, releyendo solo lo que cambió en disco"""
+    manifiesto = _manifiesto_json()
+    with manifiesto.candado:
+        mtime_archivo = _mtime_ns(RUTA_MANIFIESTO)
+        if mtime_archivo is not None and mtime_archivo != manifiesto.mtime_archivo:
+            # Otro proceso lo reescribió (o es la primera lectura)
+            try:
+                with open(RUTA_MANIFIESTO, "r", encoding="utf-8") as f:
+                    datos = json.load(f)
+                manifiesto.chats = datos["chats"]
+                manifiesto.mtime_directorio = datos["directorio"]
+                for base, numero in datos.get("secuencias", {}).items():
+                    manifiesto.secuencias[base] = max(numero, manifiesto.secuencias.get(base, 0))
+            except (OSError, ValueError, KeyError) as e:
+                logger.warning("Manifiesto de chats ilegible, se reconstruye: %s", e)
+                manifiesto.mtime_directorio = None
+            manifiesto.mtime_archivo = mtime_archivo
+        
+        mtime_directorio = _mtime_ns(CHATS_DIR)
+        if mtime_directorio != manifiesto.mtime_directorio:
+            # Se agregaron o quitaron archivos por fuera de la app: se revisan las fechas
+            # y solo se vuelven a leer los chats que cambiaron
+            nombres = set(_json_listar_chats())
+            for nombre_chat in set(manifiesto.chats) - nombres:
+                del manifiesto.chats[nombre_chat]
+                obtener_indice_busqueda().quitar(nombre_chat)
+            for nombre_chat in nombres:
+                entrada = manifiesto.chats.get(nombre_chat)
+                firma = _firma_archivos_chat(nombre_chat)
+                if entrada and entrada["mtime"] == max(f[1] for f in firma if f):
+                    continue
+                try:
+                    # Sin tomar el candado del chat: puede estar tomado por quien llamó
+                    mensajes = _leer_chat_json(nombre_chat)
+                    manifiesto.chats[nombre_chat] = _entrada_manifiesto(nombre_chat, mensajes)
+                    obtener_indice_busqueda().indexar(nombre_chat, mensajes)
+                except Exception as e:
+                    logger.warning("No se pudo indexar el chat %s: %s", nombre_chat, e)
+            manifiesto.mtime_directorio = mtime_directorio
+            _programar_guardado_manifiesto(manifiesto)
+        manifiesto.cargado = True
+        return manifiesto.chats
+
+def _programar_guardado_manifiesto(manifiesto):
+    # Varios guardados seguidos se agrupan en una sola escritura en segundo plano
+    if not manifiesto.guardado_pendiente:
+        manifiesto.guardado_pendiente = True
+        _estado_journal().compactador.submit(_guardar_manifiesto, manifiesto)
+
+def _guardar_manifiesto(manifiesto):
+    # Espera para que los cambios que lleguen mientras tanto salgan en la misma escritura
+    time.sleep(ESPERA_ESCRITURA_SEG)
+    try:
+        with manifiesto.candado:
+            manifiesto.guardado_pendiente = False
+            datos = json.dumps(
+                {"directorio": manifiesto.mtime_directorio, "chats": manifiesto.chats,
+                 "secuencias": manifiesto.secuencias},
+                ensure_ascii=False, separators=(",", ":")
+            )
+            os.makedirs(DIR_INDICE, exist_ok=True)
+            escribir_atomico(RUTA_MANIFIESTO, datos)
+            manifiesto.mtime_archivo = _mtime_ns(RUTA_MANIFIESTO)
+    except Exception as e:
+        logger.warning("No se pudo guardar el manifiesto de chats: %s", e)
+
+def _json_guardar_chat(nombre_chat, mensajes):
+    estado = _estado_journal()
+    with estado.candado_chat(nombre_chat):
+        persistido = estado.persistidos.get(nombre_chat)
+        if persistido is None or persistido[2] != _firma_archivos_chat(nombre_chat):
+            _reparar_journal(nombre_chat)
+            try:
+                guardados = _leer_chat_json(nombre_chat)
+                persistido = (len(guardados), guardados[-1] if guardados else None, None)
+            except FileNotFoundError:
+                persistido = (0, None, None)
+        cantidad, ultimo, _ = persistido
+        
+        if 0 < cantidad <= len(mensajes) and mensajes[cantidad - 1] == ultimo:
+            # La conversación solo creció: se agregan al journal los mensajes nuevos
+            desde = cantidad
+            if cantidad < len(mensajes):
+                lineas = "".join(
+                    json.dumps({"i": i, "m": m}, ensure_ascii=False) + "\n"
+                    for i, m in enumerate(mensajes[cantidad:], start=cantidad)
+                )
+                with open(_ruta_journal(nombre_chat), "a", encoding="utf-8") as f:
+                    f.write(lineas)
+                    f.flush()
+                    os.fsync(f.fileno())
+        else:
+            # Chat nuevo o historial cambiado: se reescribe el snapshot y se descarta el journal
+            desde = 0
+            if os.path.exists(_ruta_journal(nombre_chat)):
+                os.remove(_ruta_journal(nombre_chat))
+            _escribir_snapshot(nombre_chat, mensajes)
+        
+        firma = _firma_archivos_chat(nombre_chat)
+        estado.persistidos[nombre_chat] = (len(mensajes), mensajes[-1] if mensajes else None, firma)
+        _actualizar_manifiesto(nombre_chat, mensajes)
+        obtener_indice_busqueda().indexar(nombre_chat, mensajes, desde)
+    
+    if firma[1] and firma[1][0] > JOURNAL_MAX_BYTES:
+        estado.compactador.submit(_compactar_journal, nombre_chat)
+
+def _json_reservar_nombre(base):
+    """Reserva un nombre creando su snapshot vacío en modo exclusivo ("x")"""
+    manifiesto = _manifiesto_json()
+    with _estado_journal().candado_secuencias:
+        if not manifiesto.cargado:
+            _manifiesto_vigente()
+        numero = manifiesto.secuencias.get(base, 0)
+        while True:
+            nombre_chat = nombre_en_secuencia(base, numero)
+            numero += 1
+            try:
+                # Todo chat tiene snapshot, así que crearlo en exclusiva reserva el nombre
+                # también frente a otros procesos
+                with open(_ruta_snapshot(nombre_chat), "x", encoding="utf-8") as f:
+                    f.write("[]")
+            except FileExistsError:
+                continue
+            # Un chat archivado no tiene snapshot plano: su nombre también está ocupado
+            if any(os.path.exists(r) for r in _rutas_archivado(nombre_chat).values()):
+                os.remove(_ruta_snapshot(nombre_chat))
+                continue
+            break
+        with manifiesto.candado:
+            manifiesto.secuencias[base] = numero
+    _actualizar_manifiesto(nombre_chat, [])
+    return nombre_chat
+
+def _json_cargar_chat(nombre_chat):
+    with _estado_journal().candado_chat(nombre_chat):
+        return _leer_chat_json(nombre_chat)
+
+def _json_listar_chats():
+    nombres = set()
+    if not os.path.isdir(CHATS_DIR):
+        return []
+    for archivo in os.listdir(CHATS_DIR):
+        for sufijo in SUFIJOS_CHAT:
+            if archivo.endswith(sufijo):
+                nombres.add(archivo[:-len(sufijo)])
+                break
+    return list(nombres)
+
+def _json_modificado(nombre_chat):
+    """Fecha de la última escritura del chat (snapshot o journal)"""
+    return datetime.fromtimestamp(max(f[1] for f in _firma_archivos_chat(nombre_chat) if f) / 1e9)
+
+def _json_eliminar_chat(nombre_chat):
+    estado = _estado_journal()
+    with estado.candado_chat(nombre_chat):
+        borrados = 0
+        for ruta in (_ruta_snapshot(nombre_chat), _ruta_journal(nombre_chat), *_rutas_archivado(nombre_chat).values()):
+            if os.path.exists(ruta):
+                os.remove(ruta)
+                borrados += 1
+        estado.persistidos.pop(nombre_chat, None)
+        _actualizar_manifiesto(nombre_chat)
+        obtener_indice_busqueda().quitar(nombre_chat)
+    if not borrados:
+        raise FileNotFoundError(f"Chat no encontrado: {nombre_chat}")
+
+# ==================== BACKEND SQLITE ====================
+
+def _sentencias_sql(script):
+    """Separa un script en sentencias respetando los ';' dentro de CREATE TRIGGER"""
+    sentencia = ""
+    for parte in script.split(";"):
+        sentencia += parte + ";"
+        if sqlite3.complete_statement(sentencia):
+            if sentencia.strip(" \n;"):
+                yield sentencia
+            sentencia = ""
+
+def _descomprimir_sql(content, compresion):
+    """Función SQL descomprimir(content, compresion): texto de un mensaje, archivado o no"""
+    if compresion is None:
+        return content
+    return COMPRESORES[compresion][2](content).decode("utf-8")
+
+class BaseSQLite:
+    """Base SQLite en modo WAL con una conexión por hilo y migraciones por PRAGMA user_version"""
+
+    def __init__(self, ruta, migraciones):
+        self.ruta = ruta
+        os.makedirs(os.path.dirname(ruta) or ".", exist_ok=True)
+        self._local = threading.local()
+        with self.transaccion() as con:
+            self._aplicar_migraciones(con, migraciones)
+
+    def conexion(self):
+        # sqlite3 no permite compartir conexiones entre hilos: una por hilo
+        con = getattr(self._local, "con", None)
+        if con is None:
+            con = sqlite3.connect(self.ruta, timeout=30, isolation_level=None)
+            con.row_factory = sqlite3.Row
+            con.execute("PRAGMA journal_mode=WAL")
+            con.execute("PRAGMA synchronous=NORMAL")
+            con.execute("PRAGMA foreign_keys=ON")
+            con.create_function("descomprimir", 2, _descomprimir_sql, deterministic=True)
+            self._local.con = con
+        return con
+
+    @contextmanager
+    def transaccion(self):
+        con = self.conexion()
+        con.execute("BEGIN IMMEDIATE")
+        try:
+            yield con
+        except BaseException:
+            con.execute("ROLLBACK")
+            raise
+        con.execute("COMMIT")
+
+    def _aplicar_migraciones(self, con, migraciones):
+        version = con.execute("PRAGMA user_version").fetchone()[0]
+        for numero, script in enumerate(migraciones[version:], start=version + 1):
+            if callable(script):
+                script(con)
+            else:
+                for sentencia in _sentencias_sql(script):
+                    con.execute(sentencia)
+            con.execute(f"PRAGMA user_version = {numero}")
+
+def _mensaje_a_fila(mensaje):
+    """Separa las columnas fijas de un mensaje del resto de sus campos (archivos, model, ...)"""
+    extra = {k: v for k, v in mensaje.items() if k not in ("role", "content", "timestamp")}
+    return (
+        mensaje["role"],
+        mensaje["content"],
+        mensaje.get("timestamp"),
+        json.dumps(extra, ensure_ascii=False) if extra else None
+    )
+
+def _migracion_metadatos_chats(con):
+    """v2: metadatos por chat para listar sin leer los mensajes"""
+    for columna in ("titulo TEXT NOT NULL DEFAULT ''", "num_mensajes INTEGER NOT NULL DEFAULT 0",
+                    "modelos TEXT NOT NULL DEFAULT '[]'", "primer_ts TEXT", "ultimo_ts TEXT",
+                    "bytes INTEGER NOT NULL DEFAULT 0"):
+        con.execute(f"ALTER TABLE chats ADD COLUMN {columna}")
+    for chat in con.execute("SELECT id, actualizado FROM chats").fetchall():
+        filas = con.execute(
+            "SELECT role, content, timestamp, extra FROM mensajes WHERE chat_id = ? ORDER BY posicion",
+            (chat["id"],)
+        )
+        _actualizar_metadatos_chat(con, chat["id"], [_fila_a_mensaje(f) for f in filas], chat["actualizado"])
+    con.execute("CREATE INDEX chats_por_actividad ON chats (ultimo_ts DESC)")
+
+def _actualizar_metadatos_chat(con, chat_id, mensajes, actualizado):
+    resumen = resumir_chat(mensajes)
+    con.execute(
+        "UPDATE chats SET actualizado = ?, titulo = ?, num_mensajes = ?, modelos = ?, "
+        "primer_ts = ?, ultimo_ts = ?, bytes = ? WHERE id = ?",
+        (actualizado, resumen["titulo"], resumen["mensajes"], json.dumps(resumen["modelos"]),
+         resumen["primer_ts"], resumen["ultimo_ts"] or actualizado, resumen["bytes"], chat_id)
+    )
+
+def _fila_a_mensaje(fila):
+    mensaje = {"role": fila["role"], "content": fila["content"]}
+    if fila["timestamp"] is not None:
+        mensaje["timestamp"] = fila["timestamp"]
+    if fila["extra"]:
+        mensaje.update(json.loads(fila["extra"]))
+    return mensaje
+
+# Cada entrada lleva la base de la versión i a la i+1 (PRAGMA user_version):
+# un script SQL o una función que recibe la conexión
+MIGRACIONES_DB = [
+    """
+    CREATE TABLE chats (
+        id INTEGER PRIMARY KEY,
+        nombre TEXT NOT NULL UNIQUE,
+        creado TEXT NOT NULL,
+        actualizado TEXT NOT NULL
+    );
+    CREATE TABLE mensajes (
+        id INTEGER PRIMARY KEY,
+        chat_id INTEGER NOT NULL REFERENCES chats(id) ON DELETE CASCADE,
+        posicion INTEGER NOT NULL,
+        role TEXT NOT NULL,
+        content TEXT NOT NULL,
+        timestamp TEXT,
+        extra TEXT,
+        UNIQUE (chat_id, posicion)
+    );
+    CREATE TABLE meta (
+        clave TEXT PRIMARY KEY,
+        valor TEXT
+    );
+    """,
+    _migracion_metadatos_chats,
+    """
+    CREATE TABLE secuencias (
+        base TEXT PRIMARY KEY,
+        siguiente INTEGER NOT NULL
+    );
+    """,
+    f"""
+    CREATE VIRTUAL TABLE mensajes_fts USING fts5(
+        content, content='mensajes', content_rowid='id', tokenize='{TOKENIZADOR_FTS}'
+    );
+    CREATE TRIGGER mensajes_fts_insertar AFTER INSERT ON mensajes BEGIN
+        INSERT INTO mensajes_fts (rowid, content) VALUES (new.id, new.content);
+    END;
+    CREATE TRIGGER mensajes_fts_borrar AFTER DELETE ON mensajes BEGIN
+        INSERT INTO mensajes_fts (mensajes_fts, rowid, content) VALUES ('delete', old.id, old.content);
+    END;
+    INSERT INTO mensajes_fts (mensajes_fts) VALUES ('rebuild');
+    """,
+    # v5: mensajes comprimidos en los chats archivados. El índice FTS pasa a leer
+    # el texto a través de una vista que los descomprime
+    f"""
+    ALTER TABLE mensajes ADD COLUMN compresion TEXT;
+    ALTER TABLE chats ADD COLUMN archivado TEXT;
+    CREATE VIEW mensajes_texto AS
+        SELECT id, chat_id, posicion, role, descomprimir(content, compresion) AS content, timestamp, extra
+        FROM mensajes;
+    DROP TRIGGER mensajes_fts_insertar;
+    DROP TRIGGER mensajes_fts_borrar;
+    DROP TABLE mensajes_fts;
+    CREATE VIRTUAL TABLE mensajes_fts USING fts5(
+        content, content='mensajes_texto', content_rowid='id', tokenize='{TOKENIZADOR_FTS}'
+    );
+    CREATE TRIGGER mensajes_fts_insertar AFTER INSERT ON mensajes BEGIN
+        INSERT INTO mensajes_fts (rowid, content) VALUES (new.id, descomprimir(new.content, new.compresion));
+    END;
+    CREATE TRIGGER mensajes_fts_borrar AFTER DELETE ON mensajes BEGIN
+        INSERT INTO mensajes_fts (mensajes_fts, rowid, content)
+        VALUES ('delete', old.id, descomprimir(old.content, old.compresion));
+    END;
+    INSERT INTO mensajes_fts (mensajes_fts) VALUES ('rebuild');
+    """,
+]
+
+class AlmacenSQLite(BaseSQLite):
+    """Chats en una base SQLite en modo WAL: una fila por chat y una fila por mensaje"""
+
+    def __init__(self, ruta):
+        super().__init__(ruta, MIGRACIONES_DB)
+
+    def _mensajes_en_comun(self, con, chat_id, mensajes):
+        """Cantidad de mensajes guardados que coinciden con el inicio de `mensajes`"""
+        ultima = con.execute(
+            "SELECT posicion, role, content, timestamp, extra FROM mensajes_texto "
+            "WHERE chat_id = ? ORDER BY posicion DESC LIMIT 1",
+            (chat_id,)
+        ).fetchone()
+        if ultima is None:
+            return 0, 0
+        guardados = ultima["posicion"] + 1
+        # Caso habitual: la conversación solo creció, basta comparar el último mensaje guardado
+        if guardados <= len(mensajes) and _mensaje_a_fila(mensajes[guardados - 1]) == tuple(ultima)[1:]:
+            return guardados, guardados
+        filas = con.execute(
+            "SELECT role, content, timestamp, extra FROM mensajes_texto WHERE chat_id = ? ORDER BY posicion",
+            (chat_id,)
+        )
+        comunes = 0
+        for fila, mensaje in zip(filas, mensajes):
+            if _mensaje_a_fila(mensaje) != tuple(fila):
+                break
+            comunes += 1
+        return comunes, guardados
+
+    def guardar(self, nombre_chat, mensajes):
+        with self.transaccion() as con:
+            self._guardar_en(con, nombre_chat, mensajes, datetime.now().isoformat())
+
+    def guardar_lote(self, chats):
+        """Guarda varios (nombre, mensajes) en una sola transacción"""
+        ahora = datetime.now().isoformat()
+        with self.transaccion() as con:
+            for nombre_chat, mensajes in chats:
+                self._guardar_en(con, nombre_chat, mensajes, ahora)
+
+    def _guardar_en(self, con, nombre_chat, mensajes, ahora):
+        fila = con.execute("SELECT id FROM chats WHERE nombre = ?", (nombre_chat,)).fetchone()
+        if fila is None:
+            chat_id = con.execute(
+                "INSERT INTO chats (nombre, creado, actualizado) VALUES (?, ?, ?)",
+                (nombre_chat, ahora, ahora)
+            ).lastrowid
+            comunes = guardados = 0
+        else:
+            chat_id = fila["id"]
+            comunes, guardados = self._mensajes_en_comun(con, chat_id, mensajes)
+        if comunes == guardados == len(mensajes):
+            return
+        if comunes < guardados:
+            con.execute("DELETE FROM mensajes WHERE chat_id = ? AND posicion >= ?", (chat_id, comunes))
+        con.executemany(
+            "INSERT INTO mensajes (chat_id, posicion, role, content, timestamp, extra) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            [(chat_id, i, *_mensaje_a_fila(m)) for i, m in enumerate(mensajes[comunes:], start=comunes)]
+        )
+        _actualizar_metadatos_chat(con, chat_id, mensajes, ahora)
+        con.execute("UPDATE chats SET archivado = NULL WHERE id = ?", (chat_id,))
+
+    def existe(self, nombre_chat):
+        return self.conexion().execute(
+            "SELECT 1 FROM chats WHERE nombre = ? AND num_mensajes > 0", (nombre_chat,)
+        ).fetchone() is not None
+
+    def cargar(self, nombre_chat):
+        con = self.conexion()
+        fila = con.execute("SELECT id FROM chats WHERE nombre = ?", (nombre_chat,)).fetchone()
+        if fila is None:
+            raise FileNotFoundError(nombre_chat)
+        filas = con.execute(
+            "SELECT role, content, timestamp, extra FROM mensajes_texto WHERE chat_id = ? ORDER BY posicion",
+            (fila["id"],)
+        )
+        return [_fila_a_mensaje(f) for f in filas]
+
+    def listar(self, limite=None, desplazamiento=0):
+        filas = self.conexion().execute(
+            "SELECT nombre, titulo, num_mensajes, modelos, primer_ts, ultimo_ts, bytes FROM chats "
+            "WHERE num_mensajes > 0 ORDER BY ultimo_ts DESC LIMIT ? OFFSET ?",
+            (-1 if limite is None else limite, desplazamiento)
+        )
+        return [
+            {
+                "nombre": f["nombre"],
+                "titulo": f["titulo"],
+                "mensajes": f["num_mensajes"],
+                "modelos": json.loads(f["modelos"]),
+                "primer_ts": f["primer_ts"],
+                "ultimo_ts": f["ultimo_ts"],
+                "bytes": f["bytes"]
+            }
+            for f in filas
+        ]
+
+    def buscar(self, consulta, limite):
+        """Mensajes que coinciden con la consulta FTS5, del más relevante al menos relevante"""
+        return self.conexion().execute(
+            "SELECT c.nombre, c.titulo, c.ultimo_ts, "
+            f"snippet(mensajes_fts, 0, '**', '**', '…', {PALABRAS_FRAGMENTO}) AS fragmento "
+            "FROM mensajes_fts "
+            "JOIN mensajes m ON m.id = mensajes_fts.rowid "
+            "JOIN chats c ON c.id = m.chat_id "
+            "WHERE mensajes_fts MATCH ? ORDER BY rank LIMIT ?",
+            (consulta, limite)
+        ).fetchall()
+
+    def archivar(self, antes_de, compresion):
+        """Comprime los mensajes de los chats sin escrituras desde `antes_de`"""
+        comprimir = COMPRESORES[compresion][1]
+        chats = self.conexion().execute(
+            "SELECT id FROM chats WHERE actualizado < ? AND (archivado IS NULL OR archivado != ?)",
+            (antes_de, compresion)
+        ).fetchall()
+        for chat in chats:
+            with self.transaccion() as con:
+                filas = con.execute(
+                    "SELECT id, content, compresion FROM mensajes "
+                    "WHERE chat_id = ? AND (compresion IS NULL OR compresion != ?)",
+                    (chat["id"], compresion)
+                ).fetchall()
+                for fila in filas:
+                    texto = _descomprimir_sql(fila["content"], fila["compresion"]).encode("utf-8")
+                    datos = comprimir(texto)
+                    # Los mensajes cortos no ganan nada comprimidos: quedan como texto
+                    if len(datos) < len(texto):
+                        con.execute("UPDATE mensajes SET content = ?, compresion = ? WHERE id = ?",
+                                    (datos, compresion, fila["id"]))
+                    elif fila["compresion"] is not None:
+                        con.execute("UPDATE mensajes SET content = ?, compresion = NULL WHERE id = ?",
+                                    (texto.decode("utf-8"), fila["id"]))
+                con.execute("UPDATE chats SET archivado = ? WHERE id = ?", (compresion, chat["id"]))
+        return len(chats)
+
+    def compactar(self):
+        """Devuelve al sistema de archivos el espacio liberado (VACUUM)"""
+        self.conexion().execute("VACUUM")
+
+    def contar(self):
+        return self.conexion().execute("SELECT COUNT(*) FROM chats WHERE num_mensajes > 0").fetchone()[0]
+
+    def reservar_nombre(self, base):
+        """Reserva el siguiente nombre libre de la secuencia de `base` insertando un chat vacío"""
+        ahora = datetime.now().isoformat()
+        with self.transaccion() as con:
+            fila = con.execute("SELECT siguiente FROM secuencias WHERE base = ?", (base,)).fetchone()
+            numero = fila["siguiente"] if fila else 0
+            while True:
+                nombre_chat = nombre_en_secuencia(base, numero)
+                numero += 1
+                # Los nombres ya usados (por ejemplo chats anteriores a la secuencia) se saltan
+                if con.execute(
+                    "INSERT OR IGNORE INTO chats (nombre, creado, actualizado, ultimo_ts) VALUES (?, ?, ?, ?)",
+                    (nombre_chat, ahora, ahora, ahora)
+                ).rowcount:
+                    break
+            con.execute(
+                "INSERT INTO secuencias (base, siguiente) VALUES (?, ?) "
+                "ON CONFLICT (base) DO UPDATE SET siguiente = excluded.siguiente",
+                (base, numero)
+            )
+        return nombre_chat
+
+    def eliminar(self, nombre_chat):
+        with self.transaccion() as con:
+            if con.execute("DELETE FROM chats WHERE nombre = ?", (nombre_chat,)).rowcount == 0:
+                raise FileNotFoundError(f"Chat no encontrado: {nombre_chat}")
+
+    def migrar_chats_json(self, forzar=False):
+        """Importa una sola vez los chat_history/*.json existentes; los archivos no se borran"""
+        marca = self.conexion().execute("SELECT 1 FROM meta WHERE clave = 'migracion_json'").fetchone()
+        if marca and not forzar:
+            return 0
+        migrados = 0
+        existentes = {f["nombre"] for f in self.conexion().execute("SELECT nombre FROM chats")}
+        for nombre_chat in _json_listar_chats():
+            if nombre_chat in existentes:
+                continue
+            try:
+                mensajes = _json_cargar_chat(nombre_chat)
+                modificado = _json_modificado(nombre_chat).isoformat()
+                self.guardar(nombre_chat, mensajes)
+                with self.transaccion() as con:
+                    # Sin timestamps en los mensajes, la actividad es la fecha del archivo
+                    con.execute(
+                        "UPDATE chats SET creado = ?, actualizado = ?, "
+                        "ultimo_ts = CASE WHEN primer_ts IS NULL THEN ? ELSE ultimo_ts END WHERE nombre = ?",
+                        (modificado, modificado, modificado, nombre_chat)
+                    )
+                migrados += 1
+            except Exception as e:
+                logger.warning("No se pudo migrar el chat %s: %s", nombre_chat, e)
+        with self.transaccion() as con:
+            con.execute(
+                "INSERT OR REPLACE INTO meta (clave, valor) VALUES ('migracion_json', ?)",
+                (datetime.now().isoformat(),)
+            )
+        return migrados
+
+# ==================== ÍNDICE DE BÚSQUEDA DEL BACKEND JSON ====================
+
+MIGRACIONES_BUSQUEDA = [
+    f"""
+    CREATE TABLE documentos (
+        id INTEGER PRIMARY KEY,
+        chat TEXT NOT NULL,
+        posicion INTEGER NOT NULL,
+        content TEXT NOT NULL,
+        UNIQUE (chat, posicion)
+    );
+    CREATE VIRTUAL TABLE busqueda USING fts5(
+        content, content='documentos', content_rowid='id', tokenize='{TOKENIZADOR_FTS}'
+    );
+    CREATE TRIGGER busqueda_insertar AFTER INSERT ON documentos BEGIN
+        INSERT INTO busqueda (rowid, content) VALUES (new.id, new.content);
+    END;
+    CREATE TRIGGER busqueda_borrar AFTER DELETE ON documentos BEGIN
+        INSERT INTO busqueda (busqueda, rowid, content) VALUES ('delete', old.id, old.content);
+    END;
+    """,
+]
+
+class IndiceBusquedaJSON(BaseSQLite):
+    """Índice FTS5 aparte para los chats guardados como archivos"""
+
+    def __init__(self, ruta):
+        super().__init__(ruta, MIGRACIONES_BUSQUEDA)
+
+    def indexar(self, nombre_chat, mensajes, desde=0):
+        """(Re)indexa los mensajes a partir de la posición `desde`"""
+        with self.transaccion() as con:
+            con.execute("DELETE FROM documentos WHERE chat = ? AND posicion >= ?", (nombre_chat, desde))
+            con.executemany(
+                "INSERT INTO documentos (chat, posicion, content) VALUES (?, ?, ?)",
+                [(nombre_chat, i, m["content"]) for i, m in enumerate(mensajes[desde:], start=desde)]
+            )
+
+    def quitar(self, nombre_chat):
+        with self.transaccion() as con:
+            con.execute("DELETE FROM documentos WHERE chat = ?", (nombre_chat,))
+
+    def buscar(self, consulta, limite):
+        return self.conexion().execute(
+            "SELECT d.chat, "
+            f"snippet(busqueda, 0, '**', '**', '…', {PALABRAS_FRAGMENTO}) AS fragmento "
+            "FROM busqueda JOIN documentos d ON d.id = busqueda.rowid "
+            "WHERE busqueda MATCH ? ORDER BY rank LIMIT ?",
+            (consulta, limite)
+        ).fetchall()
+
+@recurso_del_proceso
+def obtener_indice_busqueda():
+    return IndiceBusquedaJSON(os.path.join(DIR_INDICE, "busqueda.db"))
+
+@recurso_del_proceso
+def obtener_almacen():
+    """Almacén compartido por todas las sesiones y reruns del proceso"""
+    almacen = AlmacenSQLite(DB_CHATS)
+    almacen.migrar_chats_json()
+    return almacen
+
+# ==================== ADJUNTOS (ALMACÉN POR CONTENIDO) ====================
+
+# Los mensajes guardan referencias {"hash", "nombre", "tipo"} en "adjuntos"; el texto
+# extraído vive una sola vez, comprimido con gzip, en
+# ADJUNTOS_DIR/<2 primeros caracteres>/<hash>.txt.gz (los <hash>.txt sin comprimir
+# de versiones anteriores se siguen leyendo y comprimir_adjuntos los convierte).
+# El hash es el de la clave de extracción (archivo, extractor, versión y opciones, ver
+# clave_adjunto): un extractor nuevo guarda su texto aparte en lugar de reusar el viejo.
+# Los chats anteriores, con el texto pegado en "content", se siguen leyendo igual.
+
+def hash_archivo(datos):
+    return hashlib.sha256(datos).hexdigest()
+
+def clave_adjunto(clave_extraccion):
+    """Hash con el que se guarda el texto de un adjunto, a partir de su clave en CacheExtraccion"""
+    return hash_archivo(clave_extraccion.encode())
+
+def es_hash_adjunto(valor):
+    """Una referencia de adjunto válida es un sha256 en hexadecimal, nunca una ruta"""
+    return isinstance(valor, str) and re.fullmatch(r"[0-9a-f]{64}", valor) is not None
+
+def _ruta_adjunto(hash_adjunto):
+    """Ruta del texto sin comprimir; la del comprimido es la misma terminada en .gz"""
+    # El hash llega de chats importados: sin validarlo podría salir de ADJUNTOS_DIR
+    if not es_hash_adjunto(hash_adjunto):
+        raise ValueError(f"referencia de adjunto inválida: {hash_adjunto!r}")
+    return os.path.join(ADJUNTOS_DIR, hash_adjunto[:2], f"{hash_adjunto}.txt")
+
+def guardar_adjunto(hash_adjunto, contenido):
+    """Guarda el texto extraído de un archivo si todavía no está en el almacén"""
+    ruta = _ruta_adjunto(hash_adjunto)
+    if not os.path.exists(ruta + ".gz") and not os.path.exists(ruta):
+        os.makedirs(os.path.dirname(ruta), exist_ok=True)
+        escribir_atomico(ruta + ".gz", COMPRESORES["gzip"][1](contenido.encode("utf-8")))
+
+def leer_adjunto(hash_adjunto):
+    """Texto de un adjunto, o None si no está en el almacén o la referencia no es válida"""
+    if not es_hash_adjunto(hash_adjunto):
+        return None
+    ruta = _ruta_adjunto(hash_adjunto)
+    try:
+        with open(ruta + ".gz", "rb") as f:
+            return gzip.decompress(f.read()).decode("utf-8")
+    except FileNotFoundError:
+        pass
+    try:
+        with open(ruta, "r", encoding="utf-8") as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+def _archivos_adjuntos():
+    """(ruta, hash) de cada archivo del almacén de adjuntos, comprimido o no"""
+    for raiz, _, archivos in os.walk(ADJUNTOS_DIR):
+        for archivo in archivos:
+            for sufijo in (".txt.gz", ".txt"):
+                if archivo.endswith(sufijo):
+                    yield os.path.join(raiz, archivo), archivo[:-len(sufijo)]
+                    break
+
+def comprimir_adjuntos():
+    """Comprime los adjuntos guardados sin comprimir por versiones anteriores; devuelve cuántos"""
+    comprimidos = 0
+    for ruta, _ in list(_archivos_adjuntos()):
+        if ruta.endswith(".txt"):
+            with open(ruta, "rb") as f:
+                escribir_atomico(ruta + ".gz", COMPRESORES["gzip"][1](f.read()))
+            os.remove(ruta)
+            comprimidos += 1
+    return comprimidos
+
+def adjuntos_referenciados():
+    """Hashes de adjuntos que usa algún chat guardado"""
+    referenciados = set()
+    for nombre_chat in listar_chats():
+        for mensaje in cargar_chat(nombre_chat) or []:
+            referenciados.update(a["hash"] for a in mensaje.get("adjuntos", []))
+    return referenciados
+
+def limpiar_adjuntos():
+    """Borra del almacén los adjuntos que ya no usa ningún chat; devuelve cuántos borró"""
+    obtener_escritor().vaciar()
+    referenciados = adjuntos_referenciados()
+    borrados = 0
+    for ruta, hash_adjunto in list(_archivos_adjuntos()):
+        if hash_adjunto not in referenciados:
+            os.remove(ruta)
+            borrados += 1
+    return borrados
+
+# ==================== CACHÉ DE RESPUESTAS ====================
+
+MIGRACIONES_CACHE_RESPUESTAS = [
+    """
+    CREATE TABLE respuestas (
+        clave TEXT PRIMARY KEY,
+        modelo TEXT NOT NULL,
+        contenido TEXT NOT NULL,
+        tokens TEXT,
+        segundos REAL,
+        creado REAL NOT NULL
+    );
+    CREATE INDEX respuestas_creado ON respuestas (creado);
+    """,
+]
+
+class CacheRespuestas(BaseSQLite):
+    """Caché de respuestas del modelo para pedidos idénticos: un LRU en memoria y una base SQLite.
+    
+    La clave es el hash del modelo, los mensajes normalizados, la temperatura y
+    max_tokens. Las entradas vencen a los `ttl` segundos de creadas. Además de los
+    aciertos se suman los segundos y tokens que se ahorraron (los que llevó la
+    respuesta original).
+    """
+
+    def __init__(self, ruta, ttl=CACHE_RESPUESTAS_TTL_SEG, limite_memoria=CACHE_RESPUESTAS_MEMORIA):
+        super().__init__(ruta, MIGRACIONES_CACHE_RESPUESTAS)
+        self.ttl = ttl
+        self.limite_memoria = limite_memoria
+        self.candado = threading.Lock()
+        self._memoria = OrderedDict()
+        self.contadores = {"memoria": 0, "disco": 0, "fallos": 0, "segundos_ahorrados": 0.0, "tokens_ahorrados": 0}
+
+    @staticmethod
+    def clave(modelo, api_messages, temperatura, max_tokens):
+        """Hash del pedido; los mensajes se normalizan (saltos de línea, espacios en los extremos)"""
+        mensajes = [
+            {"role": m["role"], "content": m["content"].replace("\r\n", "\n").strip()}
+            for m in api_messages
+        ]
+        pedido = json.dumps([modelo, mensajes, temperatura, max_tokens], ensure_ascii=False, sort_keys=True)
+        return hash_archivo(pedido.encode("utf-8"))
+
+    def obtener(self, clave):
+        """{"contenido", "tokens", "segundos"} de la respuesta guardada, o None si no hay o venció"""
+        vigente_desde = time.time() - self.ttl
+        with self.candado:
+            entrada = self._memoria.get(clave)
+            if entrada is not None and entrada["creado"] >= vigente_desde:
+                self._memoria.move_to_end(clave)
+                return self._acierto("memoria", entrada)
+        fila = self.conexion().execute(
+            "SELECT contenido, tokens, segundos, creado FROM respuestas WHERE clave = ? AND creado >= ?",
+            (clave, vigente_desde)
+        ).fetchone()
+        if fila is None:
+            with self.candado:
+                self._memoria.pop(clave, None)
+                self.contadores["fallos"] += 1
+            return None
+        entrada = {
+            "contenido": fila["contenido"],
+            "tokens": json.loads(fila["tokens"]) if fila["tokens"] else None,
+            "segundos": fila["segundos"],
+            "creado": fila["creado"]
+        }
+        with self.candado:
+            self._a_memoria(clave, entrada)
+            return self._acierto("disco", entrada)
+
+    def _acierto(self, nivel, entrada):
+        self.contadores[nivel] += 1
+        self.contadores["segundos_ahorrados"] += entrada["segundos"] or 0
+        tokens = entrada["tokens"] or {}
+        self.contadores["tokens_ahorrados"] += (tokens.get("prompt") or 0) + (tokens.get("respuesta") or 0)
+        return entrada
+
+    def guardar(self, clave, modelo, contenido, tokens, segundos):
+        entrada = {"contenido": contenido, "tokens": tokens, "segundos": segundos, "creado": time.time()}
+        with self.transaccion() as con:
+            con.execute(
+                "INSERT OR REPLACE INTO respuestas (clave, modelo, contenido, tokens, segundos, creado) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (clave, modelo, contenido, json.dumps(tokens) if tokens else None, segundos, entrada["creado"])
+            )
+            con.execute("DELETE FROM respuestas WHERE creado < ?", (entrada["creado"] - self.ttl,))
+        with self.candado:
+            self._a_memoria(clave, entrada)
+
+    def _a_memoria(self, clave, entrada):
+        self._memoria[clave] = entrada
+        self._memoria.move_to_end(clave)
+        while len(self._memoria) > self.limite_memoria:
+            self._memoria.popitem(last=False)
+
+    def tasa_aciertos(self):
+        aciertos = self.contadores["memoria"] + self.contadores["disco"]
+        consultas = aciertos + self.contadores["fallos"]
+        return aciertos / consultas if consultas else None
+
+@recurso_del_proceso
+def obtener_cache_respuestas():
+    return CacheRespuestas(DB_CACHE_RESPUESTAS)
+
+# ==================== CACHÉ DE EXTRACCIÓN ====================
+
+class CacheExtraccion:
+    """Caché en dos niveles del resultado de extraer_contenido.
+    
+    La clave combina el sha256 del archivo, el extractor y su versión. El nivel en
+    memoria es un LRU limitado en bytes; el de disco guarda cada entrada comprimida
+    en `directorio` y, al pasar `limite_disco` bytes, borra las usadas hace más tiempo
+    (cada acierto actualiza la fecha de modificación del archivo).
+    """
+
+    def __init__(self, directorio, limite_memoria=CACHE_MEMORIA_BYTES, limite_disco=CACHE_DISCO_BYTES):
+        self.directorio = directorio
+        self.limite_memoria = limite_memoria
+        self.limite_disco = limite_disco
+        self.candado = threading.Lock()
+        self._memoria = OrderedDict()
+        self._bytes_memoria = 0
+        self._bytes_disco = None
+        # Aciertos por nivel y fallos, para ver cuánto trabajo se ahorra
+        self.contadores = {"memoria": 0, "disco": 0, "fallos": 0}
+
+    @staticmethod
+    def clave(hash_datos, extension, variante=""):
+        """Clave de una extracción; `variante` distingue opciones como las páginas elegidas"""
+        extractor = obtener_extractor(extension)
+        clave = f"{hash_datos}-{extractor.nombre}-v{extractor.version}"
+        return f"{clave}-{hash_archivo(variante.encode())[:16]}" if variante else clave
+
+    def _ruta(self, clave):
+        return os.path.join(self.directorio, clave[:2], f"{clave}.json.gz")
+
+    def obtener(self, clave):
+        with self.candado:
+            if clave in self._memoria:
+                self._memoria.move_to_end(clave)
+                self.contadores["memoria"] += 1
+                return self._memoria[clave]
+        ruta = self._ruta(clave)
+        try:
+            with open(ruta, "rb") as f:
+                extraido = json.loads(gzip.decompress(f.read()))
+            os.utime(ruta)
+        except (OSError, ValueError):
+            self.contadores["fallos"] += 1
+            return None
+        self.contadores["disco"] += 1
+        self._a_memoria(clave, extraido)
+        return extraido
+
+    def guardar(self, clave, extraido):
+        self._a_memoria(clave, extraido)
+        datos = COMPRESORES["gzip"][1](json.dumps(extraido, ensure_ascii=False).encode("utf-8"))
+        ruta = self._ruta(clave)
+        os.makedirs(os.path.dirname(ruta), exist_ok=True)
+        escribir_atomico(ruta, datos)
+        with self.candado:
+            if self._bytes_disco is None:
+                self._bytes_disco = sum(tam for _, tam, _ in self._archivos_disco())
+            else:
+                self._bytes_disco += len(datos)
+            if self._bytes_disco > self.limite_disco:
+                self._recortar_disco()
+
+    def _a_memoria(self, clave, extraido):
+        tamano = len(extraido["contenido"]) + len(extraido.get("vista", ""))
+        if tamano > self.limite_memoria:
+            return
+        with self.candado:
+            if clave in self._memoria:
+                return
+            self._memoria[clave] = extraido
+            self._bytes_memoria += tamano
+            while self._bytes_memoria > self.limite_memoria:
+                _, viejo = self._memoria.popitem(last=False)
+                self._bytes_memoria -= len(viejo["contenido"]) + len(viejo.get("vista", ""))
+
+    def _archivos_disco(self):
+        for raiz, _, archivos in os.walk(self.directorio):
+            for archivo in archivos:
+                ruta = os.path.join(raiz, archivo)
+                try:
+                    estado = os.stat(ruta)
+                except FileNotFoundError:
+                    continue
+                yield ruta, estado.st_size, estado.st_mtime_ns
+
+    def _recortar_disco(self):
+        """Borra las entradas menos usadas hasta quedar en el 90% del límite"""
+        for ruta, tamano, _ in sorted(self._archivos_disco(), key=lambda a: a[2]):
+            if self._bytes_disco <= self.limite_disco * 0.9:
+                break
+            try:
+                os.remove(ruta)
+            except FileNotFoundError:
+                pass
+            self._bytes_disco -= tamano
+
+@recurso_del_proceso
+def obtener_cache_extraccion():
+    return CacheExtraccion(CACHE_EXTRACCION_DIR)
+
+# ==================== EXPORTAR / IMPORTAR TODO EL HISTORIAL ====================
+
+# Formato del zip: chats/<nombre>.json (lista de mensajes, con referencias a adjuntos)
+# y adjuntos/<hash>.txt (el texto de cada adjunto, una sola vez)
+
+def es_chat_valido(mensajes):
+    """Comprueba que un chat importado tenga el formato de lista de mensajes"""
+    return isinstance(mensajes, list) and all(
+        isinstance(m, dict) and isinstance(m.get("role"), str) and isinstance(m.get("content"), str)
+        and all(isinstance(a, dict) and es_hash_adjunto(a.get("hash"))
+                for a in m.get("adjuntos", []))
+        for m in mensajes
+    )
+
+class _SalidaEnBloques:
+    """Destino de solo escritura para ZipFile que junta lo escrito hasta que se retira"""
+
+    def __init__(self):
+        self._bloques = []
+
+    def write(self, datos):
+        self._bloques.append(bytes(datos))
+        return len(datos)
+
+    def flush(self):
+        pass
+
+    def retirar(self):
+        datos = b"".join(self._bloques)
+        self._bloques.clear()
+        return datos
+
+def iterar_exportacion_chats():
+    """Genera el zip de todos los chats por partes: en memoria hay como mucho un chat a la vez"""
+    obtener_escritor().vaciar()
+    salida = _SalidaEnBloques()
+    adjuntos = set()
+    with zipfile.ZipFile(salida, "w", zipfile.ZIP_DEFLATED) as zf:
+        for nombre_chat in listar_chats():
+            try:
+                mensajes = cargar_chat(nombre_chat)
+            except Exception:
+                logger.warning("No se pudo leer el chat %s, no se exporta", nombre_chat, exc_info=True)
+                continue
+            if mensajes is None:
+                continue
+            for mensaje in mensajes:
+                adjuntos.update(a["hash"] for a in mensaje.get("adjuntos", []))
+            with zf.open(f"chats/{nombre_chat}.json", "w") as f:
+                f.write(json.dumps(mensajes, ensure_ascii=False).encode("utf-8"))
+            yield salida.retirar()
+        for hash_adjunto in adjuntos:
+            contenido = leer_adjunto(hash_adjunto)
+            if contenido is not None:
+                with zf.open(f"adjuntos/{hash_adjunto}.txt", "w") as f:
+                    f.write(contenido.encode("utf-8"))
+                yield salida.retirar()
+    yield salida.retirar()
+
+def exportar_archivo_chats(destino):
+    """Escribe el zip de todos los chats en un archivo binario (puede ser stdout)"""
+    for bloque in iterar_exportacion_chats():
+        destino.write(bloque)
+
+def _leer_chat_exportado(zf, entrada):
+    """Lee y valida una entrada del zip; corre en los hilos de la importación"""
+    nombre_chat = normalizar_nombre_chat(os.path.basename(entrada))
+    try:
+        with zf.open(entrada) as f:
+            mensajes = json.load(f)
+    except (ValueError, OSError, zipfile.BadZipFile) as e:
+        return nombre_chat, None, f"{entrada}: {e}"
+    if not nombre_chat or not es_chat_valido(mensajes):
+        return nombre_chat, None, f"{entrada}: formato de chat inválido"
+    return nombre_chat, mensajes, None
+
+def chat_existe(nombre_chat):
+    if BACKEND_CHATS == "sqlite":
+        return obtener_almacen().existe(nombre_chat)
+    entrada = _manifiesto_vigente().get(nombre_chat)
+    return bool(entrada and entrada["mensajes"])
+
+def importar_archivo_chats(origen, reemplazar=False, hilos=IMPORTACION_HILOS, tamano_lote=IMPORTACION_LOTE):
+    """Importa un zip generado por exportar_archivo_chats.
+    
+    Las entradas se leen de a una, se validan en un grupo de hilos y se escriben en
+    lotes (una transacción por lote en SQLite). Un chat con un nombre ya usado se
+    importa con el siguiente nombre libre de su secuencia, salvo con reemplazar=True.
+    Devuelve un resumen con los importados, renombrados y errores.
+    """
+    obtener_escritor().vaciar()
+    resumen = {"importados": 0, "renombrados": 0, "errores": []}
+    with zipfile.ZipFile(origen) as zf, ThreadPoolExecutor(max_workers=hilos) as grupo:
+        entradas = [n for n in zf.namelist() if n.startswith("chats/") and n.endswith(".json")]
+        for entrada in zf.namelist():
+            hash_adjunto = os.path.basename(entrada)[:-4]
+            if entrada.startswith("adjuntos/") and es_hash_adjunto(hash_adjunto):
+                guardar_adjunto(hash_adjunto, zf.read(entrada).decode("utf-8"))
+        for inicio in range(0, len(entradas), tamano_lote):
+            lote = []
+            for nombre_chat, mensajes, error in grupo.map(
+                lambda entrada: _leer_chat_exportado(zf, entrada), entradas[inicio:inicio + tamano_lote]
+            ):
+                if error:
+                    resumen["errores"].append(error)
+                    continue
+                if not reemplazar and chat_existe(nombre_chat):
+                    nombre_chat = reservar_nombre_chat(nombre_chat)
+                    resumen["renombrados"] += 1
+                lote.append((nombre_chat, mensajes))
+            if BACKEND_CHATS == "sqlite":
+                obtener_almacen().guardar_lote(lote)
+            else:
+                for nombre_chat, mensajes in lote:
+                    _json_guardar_chat(nombre_chat, mensajes)
+            resumen["importados"] += len(lote)
+    return resumen
+
@@ -0,0 +1,141 @@
+# python herramientas.py analitica [destino]
+# Exporta el historial de chats a Parquet con una fila por mensaje, particionado
+# por mes, para responder preguntas de uso (tráfico por modelo, largo de las
+# conversaciones...) leyendo solo las columnas necesarias:
+#
+#   pd.read_parquet("analitica", columns=["model"]).value_counts()
+import json
+import logging
+import os
+import shutil
+import uuid
+from datetime import datetime
+
+import pyarrow as pa
+import pyarrow.dataset as ds
+
+import almacen
+
+ANALITICA_DIR = "analitica"
+# Las filas se escriben cada tantos chats, sin juntar todo el historial en memoria
+CHATS_POR_LOTE = 500
+# Estado de la exportación incremental; pyarrow ignora los archivos que empiezan con "_"
+ARCHIVO_ESTADO = "_estado.json"
+
+ESQUEMA = pa.schema([
+    ("chat", pa.string()),
+    ("posicion", pa.int32()),
+    ("role", pa.string()),
+    ("model", pa.string()),
+    ("timestamp", pa.timestamp("us")),
+    ("caracteres", pa.int32()),
+    ("adjuntos", pa.list_(pa.string())),
+    ("tokens_prompt", pa.int32()),
+    ("tokens_respuesta", pa.int32()),
+    ("mes", pa.string())
+])
+
+logger = logging.getLogger(__name__)
+
+
+def fila_mensaje(nombre_chat, posicion, mensaje):
+    """Aplana un mensaje guardado en una fila de la tabla de analítica"""
+    timestamp = datetime.fromisoformat(mensaje["timestamp"]) if mensaje.get("timestamp") else None
+    tokens = mensaje.get("tokens") or {}
+    return {
+        "chat": nombre_chat,
+        "posicion": posicion,
+        "role": mensaje["role"],
+        "model": mensaje.get("model"),
+        "timestamp": timestamp,
+        "caracteres": len(mensaje["content"]),
+        "adjuntos": mensaje.get("archivos") or [a["nombre"] for a in mensaje.get("adjuntos", [])],
+        "tokens_prompt": tokens.get("prompt"),
+        "tokens_respuesta": tokens.get("respuesta"),
+        "mes": timestamp.strftime("%Y-%m") if timestamp else "sin_fecha"
+    }
+
+
+def _leer_estado(destino):
+    try:
+        with open(os.path.join(destino, ARCHIVO_ESTADO), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {"chats": {}}
+
+
+def _lotes_pendientes(chats, estado, resumen):
+    """Genera lotes con los mensajes que todavía no están en el dataset"""
+    filas = []
+    for i, chat in enumerate(chats, 1):
+        previo = estado["chats"].get(chat["nombre"])
+        if previo and previo["mensajes"] == chat["mensajes"] and previo["ultimo_ts"] == chat["ultimo_ts"]:
+            continue
+        desde = 0
+        if previo:
+            # Un chat que se achicó o empezó de otra forma fue reemplazado: sus filas
+            # viejas siguen en el dataset hasta una exportación completa
+            if previo["mensajes"] > chat["mensajes"] or previo["primer_ts"] != chat["primer_ts"]:
+                resumen["desactualizados"].append(chat["nombre"])
+            else:
+                desde = previo["mensajes"]
+        try:
+            mensajes = almacen.cargar_chat(chat["nombre"])
+        except Exception:
+            logger.warning("No se pudo leer el chat %s, queda para la próxima", chat["nombre"], exc_info=True)
+            continue
+        if mensajes is None:
+            continue
+        filas.extend(fila_mensaje(chat["nombre"], posicion, mensaje)
+                     for posicion, mensaje in enumerate(mensajes[desde:], desde))
+        estado["chats"][chat["nombre"]] = {
+            "mensajes": len(mensajes),
+            "primer_ts": chat["primer_ts"],
+            "ultimo_ts": chat["ultimo_ts"]
+        }
+        resumen["chats"] += 1
+        if filas and i % CHATS_POR_LOTE == 0:
+            resumen["filas"] += len(filas)
+            yield pa.RecordBatch.from_pylist(filas, schema=ESQUEMA)
+            filas = []
+    if filas:
+        resumen["filas"] += len(filas)
+        yield pa.RecordBatch.from_pylist(filas, schema=ESQUEMA)
+
+
+def exportar_analitica(destino=ANALITICA_DIR, completo=False):
+    """Agrega al dataset Parquet los mensajes nuevos desde la última exportación.
+
+    Cada ejecución escribe archivos nuevos en destino/mes=AAAA-MM/ y nunca toca
+    los anteriores. Con completo=True se borra el dataset y se vuelve a generar,
+    lo que hace falta para quitar las filas de chats eliminados o reemplazados.
+    Devuelve un resumen con los chats y filas exportados.
+    """
+    if completo:
+        shutil.rmtree(destino, ignore_errors=True)
+    os.makedirs(destino, exist_ok=True)
+    almacen.obtener_escritor().vaciar()
+    estado = _leer_estado(destino)
+    chats = almacen.listar_chats_detalle()
+    resumen = {"chats": 0, "filas": 0, "desactualizados": []}
+    ds.write_dataset(
+        _lotes_pendientes(chats, estado, resumen),
+        destino,
+        schema=ESQUEMA,
+        format="parquet",
+        partitioning=["mes"],
+        partitioning_flavor="hive",
+        basename_template=f"parte-{datetime.now():%Y%m%d%H%M%S}-{uuid.uuid4().hex[:8]}-{{i}}.parquet",
+        existing_data_behavior="overwrite_or_ignore"
+    )
+    # El estado se escribe después de los datos: si la exportación falla a la mitad,
+    # la próxima vuelve a exportar esos mensajes en lugar de perderlos
+    vigentes = {chat["nombre"] for chat in chats}
+    resumen["eliminados"] = [nombre for nombre in estado["chats"] if nombre not in vigentes]
+    almacen.escribir_atomico(os.path.join(destino, ARCHIVO_ESTADO), json.dumps(estado, ensure_ascii=False))
+    return resumen
+
+
+def leer_analitica(destino=ANALITICA_DIR, columnas=None):
+    """Lee el dataset como DataFrame, solo con las columnas pedidas"""
+    return ds.dataset(destino, format="parquet", partitioning="hive").to_table(columns=columnas).to_pandas()
@@ -0,0 +1,104 @@
+# python benchmarks/bench_compresion.py [--chats 200]
+# Compara espacio en disco y tiempo de carga de chats planos y archivados
+# (gzip y lzma) en los dos backends, más el almacén de adjuntos que comparten.
+# Trabaja en una carpeta temporal.
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+PALABRAS = ("el la de que y en un una los las por con para como datos archivo modelo "
+            "informe ventas cliente tabla total fecha precio cantidad resumen análisis").split()
+
+
+def texto_aleatorio(palabras):
+    return " ".join(random.choices(PALABRAS, k=palabras))
+
+
+def chat_sintetico(almacen, turnos):
+    """Conversación con un CSV adjunto por turno, como la arma ejecutar_chat.
+
+    El texto de cada adjunto va al almacén de adjuntos y el mensaje guarda solo su referencia.
+    """
+    mensajes = [{"role": "assistant", "content": "¡Hola!", "timestamp": "2024-01-01T00:00:00"}]
+    for turno in range(turnos):
+        adjunto = "\n".join(f"{i},{random.randint(1, 999)},{texto_aleatorio(4)}" for i in range(300))[:10000]
+        hash_adjunto = almacen.hash_archivo(adjunto.encode("utf-8"))
+        almacen.guardar_adjunto(hash_adjunto, adjunto)
+        mensajes.append({
+            "role": "user",
+            "content": texto_aleatorio(20),
+            "timestamp": "2024-01-01T00:00:00",
+            "archivos": [f"ventas_{turno}.csv"],
+            "adjuntos": [{"hash": hash_adjunto, "nombre": f"ventas_{turno}.csv", "tipo": "csv"}]
+        })
+        mensajes.append({"role": "assistant", "content": texto_aleatorio(200),
+                         "timestamp": "2024-01-01T00:00:00", "model": "gemma2-9b-it"})
+    return mensajes
+
+
+def tamano_chats(almacen):
+    """Bytes de los chats en disco: archivos de chat (json) o la base con su índice FTS (sqlite)"""
+    if almacen.BACKEND_CHATS == "sqlite":
+        sufijos = ("chats.db", "chats.db-wal")
+    else:
+        sufijos = almacen.SUFIJOS_CHAT
+    return sum(os.path.getsize(os.path.join(almacen.CHATS_DIR, f))
+               for f in os.listdir(almacen.CHATS_DIR) if f.endswith(sufijos))
+
+
+def tamano_adjuntos(almacen):
+    return sum(os.path.getsize(os.path.join(raiz, f))
+               for raiz, _, archivos in os.walk(almacen.ADJUNTOS_DIR) for f in archivos)
+
+
+def medir_carga(almacen, nombres):
+    inicio = time.perf_counter()
+    for nombre in nombres:
+        almacen.cargar_chat(nombre)
+    return (time.perf_counter() - inicio) / len(nombres) * 1000
+
+
+def ejecutar():
+    parser = argparse.ArgumentParser(description="Benchmark de chats comprimidos")
+    parser.add_argument("--chats", type=int, default=200)
+    parser.add_argument("--turnos", type=int, default=5)
+    args = parser.parse_args()
+
+    carpeta = tempfile.mkdtemp(prefix="bench_compresion_")
+    os.chdir(carpeta)
+    import almacen
+
+    random.seed(1)
+    chats = {f"chat_{i:04d}": chat_sintetico(almacen, args.turnos) for i in range(args.chats)}
+    print(f"{args.chats} chats de {args.turnos} turnos con un CSV adjunto por turno")
+    print(f"Adjuntos (gzip, compartidos por los dos backends): {tamano_adjuntos(almacen) / 1e6:.2f} MB\n")
+    print(f"{'backend':<8} {'formato':<8} {'disco (MB)':>11} {'carga (ms/chat)':>16}")
+    for backend in ("json", "sqlite"):
+        almacen.BACKEND_CHATS = backend
+        for nombre, mensajes in chats.items():
+            almacen.guardar_chat(nombre, mensajes, en_segundo_plano=True)
+        almacen.obtener_escritor().vaciar()
+        for formato in ("plano", "gzip", "lzma"):
+            if formato != "plano":
+                almacen.archivar_chats_inactivos(dias=0, compresion=formato)
+            if backend == "sqlite":
+                almacen.obtener_almacen().conexion().execute("PRAGMA wal_checkpoint(TRUNCATE)")
+                almacen.obtener_almacen().compactar()
+            disco = tamano_chats(almacen) / 1e6
+            print(f"{backend:<8} {formato:<8} {disco:>11.2f} {medir_carga(almacen, list(chats)):>16.2f}")
+        for nombre in chats:
+            almacen.eliminar_chat(nombre)
+
+    os.chdir(RAIZ)
+    shutil.rmtree(carpeta, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    ejecutar()
@@ -0,0 +1,96 @@
+# python benchmarks/bench_extraccion.py [--repeticiones 20]
+# Mide cuánto cuesta por archivo pasar por un archivo temporal (escribirlo,
+# volver a abrirlo por ruta y borrarlo) frente a extraer directo de los bytes
+# en memoria, con archivos sintéticos de cada tipo.
+import argparse
+import io
+import os
+import sys
+import tempfile
+import time
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+import pandas as pd
+from docx import Document
+
+import extractores
+
+
+def pdf_sintetico(paginas):
+    """PDF mínimo escrito a mano (sin dependencias extra), una línea de texto por página"""
+    objetos = ["<< /Type /Catalog /Pages 2 0 R >>", None,
+               "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    hojas = []
+    for pagina in range(paginas):
+        texto = f"BT /F1 12 Tf 72 720 Td (Informe de ventas, pagina {pagina}) Tj ET".encode()
+        objetos.append(f"<< /Length {len(texto)} >>\nstream\n{texto.decode()}\nendstream")
+        objetos.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+                       f"/Resources << /Font << /F1 3 0 R >> >> /Contents {len(objetos)} 0 R >>")
+        hojas.append(f"{len(objetos)} 0 R")
+    objetos[1] = f"<< /Type /Pages /Kids [{' '.join(hojas)}] /Count {paginas} >>"
+    salida = io.BytesIO()
+    salida.write(b"%PDF-1.4\n")
+    posiciones = []
+    for numero, objeto in enumerate(objetos, 1):
+        posiciones.append(salida.tell())
+        salida.write(f"{numero} 0 obj\n{objeto}\nendobj\n".encode())
+    inicio_xref = salida.tell()
+    salida.write(f"xref\n0 {len(objetos) + 1}\n0000000000 65535 f \n".encode())
+    for posicion in posiciones:
+        salida.write(f"{posicion:010d} 00000 n \n".encode())
+    salida.write(f"trailer\n<< /Size {len(objetos) + 1} /Root 1 0 R >>\nstartxref\n{inicio_xref}\n%%EOF\n".encode())
+    return salida.getvalue()
+
+
+def archivos_sinteticos():
+    tabla = pd.DataFrame({"id": range(2000), "producto": ["teclado", "mouse"] * 1000, "precio": 1.5})
+    excel = io.BytesIO()
+    tabla.to_excel(excel, index=False)
+    doc = Document()
+    for i in range(200):
+        doc.add_paragraph(f"Párrafo {i} del informe mensual de ventas.")
+    docx = io.BytesIO()
+    doc.save(docx)
+    return {
+        "txt": ("notas del cliente\n" * 2000).encode("utf-8"),
+        "py": ("def f(x):\n    return x * 2\n" * 500).encode("utf-8"),
+        "csv": tabla.to_csv(index=False).encode("utf-8"),
+        "xlsx": excel.getvalue(),
+        "docx": docx.getvalue(),
+        "pdf": pdf_sintetico(5)
+    }
+
+
+def extraer_con_temporal(datos, extension):
+    """Lo que se hacía antes: copiar los bytes a un temporal y extraer leyendo esa ruta"""
+    with tempfile.NamedTemporaryFile(delete=False, suffix=f'.{extension}') as tmp_file:
+        tmp_file.write(datos)
+    try:
+        return extractores.extraer_contenido(tmp_file.name, extension)
+    finally:
+        os.unlink(tmp_file.name)
+
+
+def medir(funcion, datos, extension, repeticiones):
+    inicio = time.perf_counter()
+    for _ in range(repeticiones):
+        funcion(datos, extension)
+    return (time.perf_counter() - inicio) / repeticiones * 1000
+
+
+def ejecutar():
+    parser = argparse.ArgumentParser(description="Benchmark de extracción desde memoria y desde temporal")
+    parser.add_argument("--repeticiones", type=int, default=20)
+    args = parser.parse_args()
+
+    print(f"{'tipo':<6} {'tamaño (KB)':>12} {'temporal (ms)':>14} {'memoria (ms)':>13} {'ahorro (ms)':>12}")
+    for extension, datos in archivos_sinteticos().items():
+        temporal = medir(extraer_con_temporal, datos, extension, args.repeticiones)
+        memoria = medir(extractores.extraer_contenido, datos, extension, args.repeticiones)
+        print(f"{extension:<6} {len(datos) / 1024:>12.1f} {temporal:>14.2f} {memoria:>13.2f} {temporal - memoria:>12.2f}")
+
+
+if __name__ == '__main__':
+    ejecutar()
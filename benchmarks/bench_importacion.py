@@ -0,0 +1,79 @@
+# python benchmarks/bench_importacion.py [--repeticiones 5]
+# Mide el arranque en frío: cuánto tarda un proceso nuevo en importar main.py
+# ahora que los extractores cargan sus bibliotecas al primer uso, comparado
+# con importar antes esas bibliotecas como hacía main.py, y cuánto cuesta el
+# primer uso de cada extractor.
+import argparse
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Lo que main.py importaba al cargar antes del registro de extractores
+IMPORTS_ANTERIORES = ("import PIL.Image, pytesseract, pdfminer.high_level, docx, pandas; ")
+
+def escribir_muestras(carpeta):
+    """Un archivo mínimo de cada tipo, para medir el primer uso de su extractor"""
+    import io
+
+    import docx
+    import openpyxl
+
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from bench_extraccion import pdf_sintetico
+
+    documento, libro = io.BytesIO(), io.BytesIO()
+    docx.Document().save(documento)
+    openpyxl.Workbook().save(libro)
+    muestras = {"docx": documento.getvalue(), "xlsx": libro.getvalue(), "csv": b"a,b\n1,2\n",
+                "pdf": pdf_sintetico(1)}
+    for extension, datos in muestras.items():
+        with open(os.path.join(carpeta, f"muestra.{extension}"), "wb") as f:
+            f.write(datos)
+    return list(muestras)
+
+
+def medir(codigo, carpeta, repeticiones):
+    """Mediana de segundos que tarda un intérprete nuevo en ejecutar `codigo`"""
+    tiempos = []
+    for _ in range(repeticiones):
+        salida = subprocess.run(
+            [sys.executable, "-c", f"import time; t = time.perf_counter(); {codigo}; "
+                                   f"print(time.perf_counter() - t)"],
+            cwd=carpeta, env={**os.environ, "PYTHONPATH": RAIZ}, capture_output=True, text=True, check=True
+        )
+        tiempos.append(float(salida.stdout.strip().splitlines()[-1]))
+    return statistics.median(tiempos)
+
+
+def ejecutar():
+    parser = argparse.ArgumentParser(description="Benchmark del tiempo de importación")
+    parser.add_argument("--repeticiones", type=int, default=5)
+    args = parser.parse_args()
+
+    # Las muestras de cada formato se escriben en una carpeta temporal, que también
+    # es la carpeta de trabajo de los intérpretes que se miden
+    carpeta = tempfile.mkdtemp(prefix="bench_importacion_")
+    try:
+        anterior = medir(f"{IMPORTS_ANTERIORES}import main", carpeta, args.repeticiones)
+        actual = medir("import main", carpeta, args.repeticiones)
+        print(f"{'import main con las bibliotecas de extracción':<48} {anterior:>7.2f} s")
+        print(f"{'import main con extractores perezosos':<48} {actual:>7.2f} s")
+        print(f"{'ahorro al arrancar':<48} {anterior - actual:>7.2f} s\n")
+
+        print("Primer uso de cada extractor en un proceso nuevo (importa su biblioteca):")
+        for extension in escribir_muestras(carpeta):
+            preparar = f"datos = open('muestra.{extension}', 'rb').read(); import extractores"
+            codigo = f"{preparar}; extractores.extraer_contenido(datos, '{extension}')"
+            base = medir(preparar, carpeta, args.repeticiones)
+            print(f"  {extension:<6} {medir(codigo, carpeta, args.repeticiones) - base:>7.2f} s")
+    finally:
+        shutil.rmtree(carpeta, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    ejecutar()
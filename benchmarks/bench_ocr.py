@@ -0,0 +1,92 @@
+# python benchmarks/bench_ocr.py [--repeticiones 3]
+# Compara el OCR anterior (image_to_string sobre la imagen original, solo el
+# primer cuadro) con ocr.extraer_texto_imagen sobre imágenes sintéticas con
+# texto conocido: tiempo por imagen y proporción de palabras recuperadas.
+# Necesita Tesseract instalado.
+import argparse
+import io
+import os
+import random
+import re
+import sys
+import time
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+import pytesseract
+from PIL import Image, ImageDraw, ImageFilter, ImageFont
+
+import ocr
+
+PALABRAS = ("informe ventas cliente tabla total fecha precio cantidad resumen análisis "
+            "factura producto mensual pedido entrega stock proveedor importe").split()
+
+
+def renglones(cantidad):
+    return [" ".join(random.choices(PALABRAS, k=8)) for _ in range(cantidad)]
+
+
+def pagina(texto, ancho, alto, tamano_letra, ruido=False):
+    imagen = Image.new("RGB", (ancho, alto), (235, 232, 225) if ruido else "white")
+    dibujo = ImageDraw.Draw(imagen)
+    fuente = ImageFont.load_default(size=tamano_letra)
+    for numero, renglon in enumerate(texto):
+        dibujo.text((tamano_letra * 3, tamano_letra * 3 + numero * tamano_letra * 2), renglon, fill=(30, 30, 30), font=fuente)
+    if ruido:
+        imagen = imagen.filter(ImageFilter.GaussianBlur(1))
+    return imagen
+
+
+def guardar(imagen, formato, **opciones):
+    salida = io.BytesIO()
+    imagen.save(salida, formato, **opciones)
+    return salida.getvalue()
+
+
+def corpus():
+    """(nombre, bytes, palabras esperadas) de cada imagen sintética"""
+    captura = renglones(20)
+    escaneo = renglones(70)
+    cuadros = [renglones(4) for _ in range(3)]
+    gif = [pagina(texto, 900, 300, 28).convert("P") for texto in cuadros]
+    return [
+        ("captura 1600x1000", guardar(pagina(captura, 1600, 1000, 28), "PNG"), captura),
+        ("escaneo A4 600 DPI", guardar(pagina(escaneo, 4960, 7016, 72, ruido=True), "PNG", dpi=(600, 600)), escaneo),
+        ("GIF de 3 cuadros", guardar(gif[0], "GIF", save_all=True, append_images=gif[1:], duration=500), sum(cuadros, []))
+    ]
+
+
+def recuperadas(texto, esperado):
+    palabras = re.findall(r"\w+", " ".join(esperado).lower())
+    leidas = set(re.findall(r"\w+", texto.lower()))
+    return sum(palabra in leidas for palabra in palabras) / len(palabras)
+
+
+def ocr_anterior(datos):
+    return pytesseract.image_to_string(Image.open(io.BytesIO(datos)))
+
+
+def ocr_nuevo(datos):
+    return ocr.extraer_texto_imagen(io.BytesIO(datos))["contenido"]
+
+
+def ejecutar():
+    parser = argparse.ArgumentParser(description="Benchmark del OCR de imágenes")
+    parser.add_argument("--repeticiones", type=int, default=3)
+    args = parser.parse_args()
+
+    random.seed(1)
+    pytesseract.pytesseract.tesseract_cmd = ocr.detectar_tesseract()
+    print(f"{'imagen':<20} {'método':<9} {'segundos':>9} {'palabras':>9}")
+    for nombre, datos, esperado in corpus():
+        for metodo, funcion in (("anterior", ocr_anterior), ("nuevo", ocr_nuevo)):
+            inicio = time.perf_counter()
+            for _ in range(args.repeticiones):
+                texto = funcion(datos)
+            segundos = (time.perf_counter() - inicio) / args.repeticiones
+            print(f"{nombre:<20} {metodo:<9} {segundos:>9.2f} {recuperadas(texto, esperado):>9.0%}")
+
+
+if __name__ == '__main__':
+    ejecutar()
@@ -0,0 +1,264 @@
+# Extracción de texto de los archivos subidos, sin nada de Streamlit: main.py
+# la ejecuta en un grupo de procesos, que necesita importar estas funciones
+# desde un módulo (el script que corre Streamlit no se puede importar).
+#
+# Cada tipo de archivo se registra con @registrar e importa su biblioteca
+# (PIL, pdfminer, openpyxl, pandas...) recién la primera vez que se usa, así
+# abrir la app no paga por bibliotecas que quizás nunca hagan falta.
+import io
+import os
+
+# Extensiones permitidas agrupadas por tipo
+EXTENSIONES_PERMITIDAS = {
+    'imagen': ['png', 'jpg', 'jpeg', 'svg', 'bmp', 'gif'],
+    'documento': ['pdf', 'docx', 'txt', 'rtf'],
+    'codigo': ['py', 'html', 'css', 'js', 'json', 'xml', 'csv', 'md'],
+    'datos': ['xlsx', 'xls', 'csv']
+}
+
+# Caracteres de cada adjunto que se mandan al modelo (los fragmentos más relevantes
+# para la pregunta) y máximo que se extrae de un PDF para buscar en él
+LIMITE_CARACTERES_ADJUNTO = 10000
+LIMITE_CARACTERES_EXTRACCION = 2_000_000
+
+# Tamaño hasta el que cada extractor procesa un archivo entero; por encima los que
+# admiten extracción parcial leen una muestra y el resto rechaza el archivo
+IMAGEN_MAXIMO_BYTES = 50 * 1024 * 1024
+EXCEL_MAXIMO_BYTES = 50 * 1024 * 1024
+# Filas que se leen de una planilla que pasa de EXCEL_MAXIMO_BYTES
+FILAS_MUESTRA_ARCHIVO_GRANDE = 100_000
+
+# Costo aproximado de cada extractor: los de costo bajo se ejecutan en el momento
+# en lugar de mandarse al grupo de procesos
+COSTO_BAJO = "bajo"
+COSTO_MEDIO = "medio"
+COSTO_ALTO = "alto"
+
+
+class ExtraccionCancelada(Exception):
+    """La extracción se canceló desde la app (se chequea en cada página, cuadro o bloque)"""
+
+
+class ArchivoDemasiadoGrande(ValueError):
+    """El archivo pasa del tamaño que su extractor puede procesar y no admite extracción parcial"""
+
+
+class Extractor:
+    """Un tipo de archivo registrado: cómo se extrae y qué se sabe de esa extracción.
+
+    `version` se sube cuando cambia la salida (invalida sus entradas en la caché);
+    `streaming` indica si lee el archivo de a partes en lugar de cargarlo entero.
+    Los archivos de más de `maximo_bytes` se procesan con parcial=True si el
+    extractor lo admite (`parcial`) o se rechazan con ArchivoDemasiadoGrande.
+    """
+
+    def __init__(self, nombre, extensiones, funcion, version, streaming, costo, maximo_bytes=None, parcial=False):
+        self.nombre = nombre
+        self.extensiones = extensiones
+        self.funcion = funcion
+        self.version = version
+        self.streaming = streaming
+        self.costo = costo
+        self.maximo_bytes = maximo_bytes
+        self.parcial = parcial
+
+
+EXTRACTORES = {}
+EXTRACTOR_POR_EXTENSION = {}
+
+
+def registrar(nombre, extensiones, version, streaming, costo, maximo_bytes=None, parcial=False):
+    """Registra la función decorada como extractor de `extensiones`.
+
+    Un registro posterior reemplaza al anterior en las extensiones que comparten.
+    """
+    def decorador(funcion):
+        extractor = Extractor(nombre, extensiones, funcion, version, streaming, costo, maximo_bytes, parcial)
+        EXTRACTORES[nombre] = extractor
+        for extension in extensiones:
+            EXTRACTOR_POR_EXTENSION[extension] = extractor
+        return funcion
+    return decorador
+
+
+def obtener_extractor(extension):
+    """Extractor registrado para una extensión; las desconocidas se leen como texto"""
+    return EXTRACTOR_POR_EXTENSION.get(extension, EXTRACTORES["texto"])
+
+
+def extractor_de(extension):
+    """Nombre del extractor que procesa una extensión"""
+    return obtener_extractor(extension).nombre
+
+
+def abrir_origen(origen):
+    """Archivo binario para leer `origen`: bytes en memoria (sin copiarlos) o la ruta de un archivo"""
+    if isinstance(origen, str):
+        return open(origen, 'rb')
+    return io.BytesIO(origen)
+
+
+def tamano_origen(origen):
+    return os.path.getsize(origen) if isinstance(origen, str) else len(origen)
+
+
+def extraer_contenido(origen, extension, avance=None, **opciones):
+    """Extrae el texto de un archivo sin mostrar nada; el resultado se puede guardar en caché.
+
+    `origen` son los bytes del archivo o, para los grandes, la ruta de una copia en
+    disco; `opciones` van al extractor (p. ej. `paginas` de un PDF). Los extractores
+    que avanzan por partes llaman a `avance(hechas, total)` después de cada página,
+    cuadro o bloque (total puede ser None), y ahí se puede cortar lanzando
+    ExtraccionCancelada. Devuelve {"contenido": texto} y, según el tipo, "cuadros"
+    (imagen), "paginas", "paginas_leidas" y "limite_alcanzado" (PDF) o "vista" (primeras filas de una
+    tabla, en JSON) para la vista previa; si solo se leyó una parte del archivo,
+    "parcial" dice cuál.
+    """
+    extractor = obtener_extractor(extension)
+    tamano = tamano_origen(origen)
+    if extractor.maximo_bytes and tamano > extractor.maximo_bytes:
+        if not extractor.parcial:
+            raise ArchivoDemasiadoGrande(
+                f"el archivo pesa {tamano / 2**20:.0f} MB y el máximo para {extractor.nombre} "
+                f"es {extractor.maximo_bytes / 2**20:.0f} MB")
+        opciones["parcial"] = True
+    with abrir_origen(origen) as archivo:
+        return extractor.funcion(archivo, extension, avance=avance, **opciones)
+
+
+def extraer_con_avance(origen, extension, estado, id_trabajo, **opciones):
+    """extraer_contenido para un trabajo en segundo plano.
+
+    `estado` es un diccionario compartido con la app (un proxy de Manager entre
+    procesos): el avance se publica en estado[(id_trabajo, "avance")] y la app pide
+    cancelar poniendo estado[(id_trabajo, "cancelar")].
+    """
+    def avance(hechas, total=None):
+        if estado.get((id_trabajo, "cancelar")):
+            raise ExtraccionCancelada()
+        estado[(id_trabajo, "avance")] = (hechas, total)
+
+    avance(0)
+    return extraer_contenido(origen, extension, avance=avance, **opciones)
+
+
+# ==================== EXTRACTORES ====================
+
+# Va primero: los tipos registrados después se quedan con sus extensiones (pdf, docx, csv)
+@registrar("texto", EXTENSIONES_PERMITIDAS['documento'] + EXTENSIONES_PERMITIDAS['codigo'],
+           version=2, streaming=True, costo=COSTO_BAJO)
+def extraer_texto(archivo, extension, avance=None, limite=LIMITE_CARACTERES_EXTRACCION):
+    contenido = io.TextIOWrapper(archivo, encoding='utf-8').read(limite + 1)
+    if len(contenido) > limite:
+        return {"contenido": contenido[:limite], "parcial": f"primeros {limite} caracteres"}
+    return {"contenido": contenido}
+
+
+@registrar("imagen", EXTENSIONES_PERMITIDAS['imagen'], version=2, streaming=False, costo=COSTO_ALTO,
+           maximo_bytes=IMAGEN_MAXIMO_BYTES)
+def extraer_imagen(archivo, extension, avance=None):
+    from ocr import extraer_texto_imagen
+    return extraer_texto_imagen(archivo, avance=avance)
+
+
+def contar_paginas_pdf(archivo):
+    """Páginas del PDF según su catálogo, sin interpretar ninguna; None si no se puede leer"""
+    from pdfminer.pdfdocument import PDFDocument
+    from pdfminer.pdfparser import PDFParser
+    from pdfminer.pdftypes import resolve1
+    try:
+        return resolve1(resolve1(PDFDocument(PDFParser(archivo)).catalog["Pages"])["Count"])
+    except Exception:
+        return None
+    finally:
+        archivo.seek(0)
+
+
+def iterar_paginas_pdf(archivo, paginas=None):
+    """Genera el texto de cada página del PDF, de a una; `paginas` limita a esos índices (desde 0)"""
+    from pdfminer.high_level import extract_pages
+    from pdfminer.layout import LTTextContainer
+    for pagina in extract_pages(archivo, page_numbers=paginas):
+        yield "".join(elemento.get_text() for elemento in pagina if isinstance(elemento, LTTextContainer))
+
+
+@registrar("pdf", ['pdf'], version=4, streaming=True, costo=COSTO_ALTO)
+def extraer_pdf(archivo, extension="pdf", avance=None, limite=LIMITE_CARACTERES_EXTRACCION, paginas=None):
+    """Extrae páginas hasta juntar `limite` caracteres, sin analizar el resto del documento.
+    
+    "paginas" es el total del documento (None si no se pudo contar) y
+    "limite_alcanzado" dice si la lectura se cortó por el límite de texto.
+    """
+    total = contar_paginas_pdf(archivo)
+    a_leer = len(paginas) if paginas is not None else total
+    partes = []
+    caracteres = 0
+    limite_alcanzado = False
+    for texto in iterar_paginas_pdf(archivo, paginas):
+        partes.append(texto)
+        caracteres += len(texto) + 1
+        if avance:
+            avance(len(partes), a_leer)
+        if limite and caracteres >= limite:
+            limite_alcanzado = True
+            break
+    return {
+        "contenido": "\x0c".join(partes),
+        "paginas": total,
+        "paginas_leidas": len(partes),
+        "limite_alcanzado": limite_alcanzado
+    }
+
+
+# Espacio de nombres de WordprocessingML y lo que aporta al texto cada etiqueta de un párrafo
+W = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+TEXTO_ETIQUETAS_DOCX = {W + "tab": "\t", W + "br": "\n", W + "cr": "\n"}
+
+
+def parrafos_docx(archivo):
+    """Genera el texto de cada párrafo (también los de tablas) recorriendo el XML del documento.
+
+    A diferencia de python-docx no arma el árbol del documento: cada párrafo se
+    vacía apenas se leyó, así que la memoria no crece con el tamaño del archivo.
+    """
+    import zipfile
+    from xml.etree.ElementTree import iterparse
+    with zipfile.ZipFile(archivo) as docx, docx.open("word/document.xml") as xml:
+        for _, elemento in iterparse(xml):
+            if elemento.tag == W + "p":
+                yield "".join(hijo.text or "" if hijo.tag == W + "t" else TEXTO_ETIQUETAS_DOCX.get(hijo.tag, "")
+                              for hijo in elemento.iter())
+                elemento.clear()
+
+
+@registrar("docx", ['docx'], version=2, streaming=True, costo=COSTO_MEDIO)
+def extraer_docx(archivo, extension, avance=None, limite=LIMITE_CARACTERES_EXTRACCION):
+    partes = []
+    caracteres = 0
+    for texto in parrafos_docx(archivo):
+        partes.append(texto)
+        caracteres += len(texto) + 1
+        if limite and caracteres > limite:
+            return {"contenido": "\n".join(partes)[:limite], "parcial": f"primeros {limite} caracteres"}
+    return {"contenido": "\n".join(partes)}
+
+
+@registrar("excel", ['xlsx', 'xls'], version=3, streaming=True, costo=COSTO_MEDIO,
+           maximo_bytes=EXCEL_MAXIMO_BYTES, parcial=True)
+def extraer_excel(archivo, extension, avance=None, parcial=False):
+    import pandas as pd
+    from tablas import bloques_excel, resumir_tabla
+    filas = FILAS_MUESTRA_ARCHIVO_GRANDE if parcial else None
+    # openpyxl solo lee .xlsx; los .xls viejos se cargan con pandas
+    bloques = bloques_excel(archivo, filas) if extension == "xlsx" else [pd.read_excel(archivo, nrows=filas)]
+    resultado = resumir_tabla(bloques, "Datos tabulares", avance)
+    if parcial:
+        resultado["parcial"] = f"primeras {filas} filas"
+        resultado["contenido"] = f"(Muestra: primeras {filas} filas de una planilla grande)\n" + resultado["contenido"]
+    return resultado
+
+
+@registrar("csv", ['csv'], version=2, streaming=True, costo=COSTO_MEDIO)
+def extraer_csv(archivo, extension, avance=None):
+    from tablas import bloques_csv, resumir_tabla
+    return resumir_tabla(bloques_csv(archivo), "Datos CSV", avance)
@@ -0,0 +1,104 @@
+# python herramientas.py --help
+# Tareas de mantenimiento del historial de chats. Ejecutar desde la carpeta del
+# proyecto, igual que la app, para que use el mismo chat_history.
+import argparse
+import sys
+
+import almacen
+import analitica
+
+
+def comando_migrar(args):
+    """Vuelve a importar los chat_history/*.json que falten en la base SQLite"""
+    if almacen.BACKEND_CHATS != "sqlite":
+        print("La migración solo aplica al backend sqlite")
+        return
+    migrados = almacen.obtener_almacen().migrar_chats_json(forzar=True)
+    print(f"Chats migrados: {migrados}")
+
+
+def comando_recomprimir(args):
+    """Comprime los chats inactivos (y recomprime los de otro compresor) y los adjuntos sin comprimir"""
+    archivados = almacen.archivar_chats_inactivos(args.dias, args.compresion)
+    print(f"Chats archivados con {args.compresion}: {archivados}")
+    print(f"Adjuntos comprimidos: {almacen.comprimir_adjuntos()}")
+    if args.vacuum and almacen.BACKEND_CHATS == "sqlite":
+        almacen.obtener_almacen().compactar()
+        print("Base de datos compactada")
+
+
+def comando_limpiar_adjuntos(args):
+    """Borra los adjuntos que ya no usa ningún chat guardado"""
+    print(f"Adjuntos borrados: {almacen.limpiar_adjuntos()}")
+
+
+def comando_exportar(args):
+    """Exporta todos los chats a un zip, escrito por partes ('-' = salida estándar)"""
+    if args.destino == "-":
+        almacen.exportar_archivo_chats(sys.stdout.buffer)
+        return
+    with open(args.destino, "wb") as destino:
+        almacen.exportar_archivo_chats(destino)
+    print(f"Historial exportado en {args.destino}")
+
+
+def comando_importar(args):
+    """Importa un zip generado con 'exportar'"""
+    resumen = almacen.importar_archivo_chats(args.origen, reemplazar=args.reemplazar, hilos=args.hilos)
+    print(f"Chats importados: {resumen['importados']} (renombrados: {resumen['renombrados']})")
+    for error in resumen["errores"]:
+        print(f"  Error: {error}")
+
+
+def comando_analitica(args):
+    """Agrega los mensajes nuevos al dataset Parquet de analítica (una fila por mensaje)"""
+    resumen = analitica.exportar_analitica(args.destino, completo=args.completo)
+    print(f"Chats exportados: {resumen['chats']} ({resumen['filas']} filas) en {args.destino}")
+    pendientes = resumen["desactualizados"] + resumen["eliminados"]
+    if pendientes:
+        print(f"  {len(pendientes)} chats eliminados o reemplazados conservan filas viejas; "
+              f"usar --completo para regenerar el dataset")
+
+
+def ejecutar():
+    parser = argparse.ArgumentParser(description="Mantenimiento del historial de chats")
+    subcomandos = parser.add_subparsers(dest="comando", required=True)
+
+    migrar = subcomandos.add_parser("migrar", help=comando_migrar.__doc__)
+    migrar.set_defaults(funcion=comando_migrar)
+
+    recomprimir = subcomandos.add_parser("recomprimir", help=comando_recomprimir.__doc__)
+    recomprimir.add_argument("--dias", type=int, default=almacen.DIAS_PARA_ARCHIVAR,
+                             help="días sin actividad para archivar un chat (0 = todos)")
+    recomprimir.add_argument("--compresion", choices=list(almacen.COMPRESORES), default=almacen.COMPRESION_ARCHIVO)
+    recomprimir.add_argument("--vacuum", action="store_true",
+                             help="en SQLite, devolver al disco el espacio liberado")
+    recomprimir.set_defaults(funcion=comando_recomprimir)
+
+    limpiar = subcomandos.add_parser("limpiar-adjuntos", help=comando_limpiar_adjuntos.__doc__)
+    limpiar.set_defaults(funcion=comando_limpiar_adjuntos)
+
+    exportar = subcomandos.add_parser("exportar", help=comando_exportar.__doc__)
+    exportar.add_argument("destino", help="archivo .zip de salida o '-'")
+    exportar.set_defaults(funcion=comando_exportar)
+
+    importar = subcomandos.add_parser("importar", help=comando_importar.__doc__)
+    importar.add_argument("origen", help="archivo .zip generado con 'exportar'")
+    importar.add_argument("--reemplazar", action="store_true",
+                          help="sobrescribir los chats con el mismo nombre en lugar de renombrarlos")
+    importar.add_argument("--hilos", type=int, default=almacen.IMPORTACION_HILOS)
+    importar.set_defaults(funcion=comando_importar)
+
+    exportar_analitica = subcomandos.add_parser("analitica", help=comando_analitica.__doc__)
+    exportar_analitica.add_argument("destino", nargs="?", default=analitica.ANALITICA_DIR,
+                                    help="carpeta del dataset Parquet")
+    exportar_analitica.add_argument("--completo", action="store_true",
+                                    help="borrar el dataset y volver a exportar todos los chats")
+    exportar_analitica.set_defaults(funcion=comando_analitica)
+
+    args = parser.parse_args()
+    args.funcion(args)
+
+
+if __name__ == '__main__':
+    ejecutar()
@@ -1,23 +1,52 @@
 # streamlit run main.py
 import streamlit as st
 import groq
+import httpx
 import os
 import tempfile
 from datetime import datetime
 import time
-from PIL import Image
-import pytesseract
-from pdfminer.high_level import extract_text
-from docx import Document
-import pandas as pd
 import json
+import atexit
+import io
+import logging
+import multiprocessing
+import shutil
+import threading
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+import almacen
+from almacen import (CacheRespuestas, clave_adjunto, es_chat_valido, generar_nombre_por_defecto, guardar_adjunto,
+                     hash_archivo, importar_archivo_chats, leer_adjunto, obtener_cache_extraccion,
+                     obtener_cache_respuestas, obtener_escritor, programar_archivado)
+from extractores import (COSTO_BAJO, EXTENSIONES_PERMITIDAS, LIMITE_CARACTERES_ADJUNTO, ExtraccionCancelada,
+                         extractor_de, extraer_con_avance, extraer_contenido, obtener_extractor)
 
-# Configura Tesseract OCR (necesita instalación aparte)
-pytesseract.pytesseract.tesseract_cmd = r'C:\Program Files\Tesseract-OCR\tesseract.exe'  # Ajustar según tu sistema
+# Dónde y cómo se guardan los chats, los adjuntos y las cachés: ver almacen.py
 
-# Configuración de directorio para historial de chats
-CHATS_DIR = "chat_history"
-os.makedirs(CHATS_DIR, exist_ok=True)
+# Procesos que extraen los archivos subidos en paralelo (0 = en el mismo proceso, de a uno)
+# y tiempo máximo de extracción de cada archivo
+EXTRACCION_PROCESOS = min(4, os.cpu_count() or 1)
+EXTRACCION_TIMEOUT_SEG = 120
+# Los archivos más grandes que esto se copian a disco por bloques y se extraen desde
+# esa copia, en lugar de duplicar sus bytes en memoria y mandarlos por el pipe
+EXTRACCION_EN_DISCO_BYTES = 8 * 1024 * 1024
+BLOQUE_COPIA_BYTES = 1024 * 1024
+# Cada cuánto se actualiza el avance de las extracciones en curso y cuánto se espera,
+# después de pedirle cortar a una que venció, antes de reiniciar el grupo de procesos
+EXTRACCION_REFRESCO_SEG = 1
+EXTRACCION_GRACIA_SEG = 10
+# Veces que se vuelve a mandar un trabajo que se perdió porque se reinició el grupo
+# de procesos por culpa de otro (de cualquier sesión: el grupo es compartido)
+EXTRACCION_REENVIOS = 2
+# Qué cuenta el avance de cada extractor
+UNIDADES_AVANCE = {"pdf": "páginas", "imagen": "cuadros", "excel": "filas", "csv": "filas"}
+
+logger = logging.getLogger(__name__)
+
+# Chats que se muestran por página en la barra lateral
+CHATS_POR_PAGINA = 50
 
 # Modelos disponibles
 MODELOS = {
@@ -27,105 +56,526 @@ MODELOS = {
     'meta-llama/llama-4-scout-17b-16e-instruct': "Llama 4 optimizado para instrucciones"
 }
 
-# Extensiones permitidas agrupadas por tipo
-EXTENSIONES_PERMITIDAS = {
-    'imagen': ['png', 'jpg', 'jpeg', 'svg', 'bmp', 'gif'],
-    'documento': ['pdf', 'docx', 'txt', 'rtf'],
-    'codigo': ['py', 'html', 'css', 'js', 'json', 'xml', 'csv', 'md'],
-    'datos': ['xlsx', 'xls', 'csv']
+# Tokens de contexto de cada modelo (los desconocidos usan CONTEXTO_POR_DEFECTO) y
+# tokens que se reservan para la respuesta
+CONTEXTO_MODELOS = {
+    'compound-beta': 131072,
+    'compound-beta-mini': 131072,
+    'gemma2-9b-it': 8192,
+    'meta-llama/llama-4-scout-17b-16e-instruct': 131072
 }
+CONTEXTO_POR_DEFECTO = 8192
+MAX_TOKENS_RESPUESTA = 2048
+TEMPERATURA = 0.7
 
-# ==================== FUNCIONES PARA HISTORIAL DE CHATS ====================
+# Tokens de historial que se mandan como máximo aunque el modelo admita más (costo y
+# latencia crecen con cada turno); lo que no entra se reemplaza por un resumen de
+# hasta TOKENS_RESUMEN tokens. Al resumir, la ventana textual queda en FRACCION_VENTANA
+# del presupuesto para que los turnos siguientes reutilicen el mismo resumen
+PRESUPUESTO_CONTEXTO_TOKENS = 16000
+TOKENS_RESUMEN = 1024
+FRACCION_VENTANA = 0.5
+# Estimación de tokens sin tokenizador: caracteres por token (el español rinde menos
+# que el inglés) y tokens de formato de cada mensaje
+CARACTERES_POR_TOKEN = 3.5
+TOKENS_POR_MENSAJE = 4
+INSTRUCCION_RESUMEN = (
+    "Resumí la conversación entre un usuario y un asistente para poder continuarla sin "
+    "el texto original. Conservá datos concretos, decisiones, nombres de archivos y "
+    "preguntas pendientes. Si hay un resumen previo, integralo. Respondé solo con el resumen."
+)
 
-def generar_nombre_por_defecto(mensajes):
-    """Genera un nombre para el chat basado en un resumen de los primeros mensajes"""
-    try:
-        # Obtener los primeros 5 mensajes del usuario
-        mensajes_usuario = [m["content"] for m in mensajes if m["role"] == "user"][:5]
-        
-        # Crear un texto base combinando los mensajes
-        texto_completo = " ".join(mensajes_usuario)
-        
-        # Generar un resumen de máximo 6 palabras
-        palabras = texto_completo.split()[:6]
-        resumen = " ".join(palabras).lower()
-        
-        # Limpiar el texto para nombre de archivo
-        caracteres_permitidos = "abcdefghijklmnopqrstuvwxyz0123456789"
-        texto_limpio = "".join(c if c.lower() in caracteres_permitidos else "_" for c in resumen)
-        texto_limpio = texto_limpio.strip("_").replace("__", "_")
-        
-        # Si no hay contenido válido, usar 'chat'
-        if not texto_limpio or len(texto_limpio) < 3:
-            texto_limpio = "chat"
-        
-        # Buscar si ya existe un chat con ese nombre base
-        chats_existentes = [f for f in os.listdir(CHATS_DIR) if f.startswith(texto_limpio)]
-        numero = f"{len(chats_existentes):02d}"  # Formato 00, 01, etc.
-        
-        # Combinar con número de versión si hay chats existentes
-        if len(chats_existentes) > 0:
-            nombre_final = f"{texto_limpio}_{numero}"
-        else:
-            nombre_final = texto_limpio
-            
-        return nombre_final
-        
-    except Exception:
-        # Fallback con timestamp si hay algún error
-        return f"chat_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+# Caché de respuestas para pedidos idénticos (mismo modelo, historial y parámetros):
+# si está activa por defecto (cada sesión la puede desactivar)
+CACHE_RESPUESTAS_ACTIVA = True
 
-def guardar_chat(nombre_chat, mensajes):
-    """Guarda el chat actual en un archivo JSON"""
+# Mostrar la respuesta a medida que el modelo la genera y cada cuánto se redibuja
+RESPUESTA_EN_STREAMING = True
+REFRESCO_STREAMING_SEG = 0.05
+
+# Cliente de Groq compartido por todas las sesiones del proceso: conexiones abiertas
+# como máximo, cuántas quedan vivas esperando el próximo pedido y por cuánto tiempo,
+# tiempo para conectar y para cada lectura (en streaming, entre un fragmento y otro)
+# y reintentos del SDK ante errores de red o 429/5xx
+GROQ_CONEXIONES_MAXIMAS = 20
+GROQ_CONEXIONES_VIVAS = 10
+GROQ_KEEPALIVE_SEG = 120
+GROQ_TIMEOUT_CONEXION_SEG = 5
+GROQ_TIMEOUT_LECTURA_SEG = 60
+GROQ_REINTENTOS = 2
+# Abrir la conexión (DNS, TCP y TLS) en segundo plano apenas se crea el cliente, así
+# el primer mensaje no paga el saludo con el servidor
+GROQ_PRECALENTAR = True
+
+# Hilos compartidos por todas las sesiones para consultar a varios modelos a la vez
+# en el modo comparación
+COMPARACION_HILOS = 8
+
+# ==================== HISTORIAL DE CHATS ====================
+
+# Las funciones de almacen.py lanzan sus errores; estas los muestran en la app
+
+def guardar_chat(nombre_chat, mensajes, en_segundo_plano=False):
+    """Guarda el chat actual (ver almacen.guardar_chat); devuelve si se pudo guardar"""
     try:
-        # Asegurarse de que el nombre no tenga caracteres inválidos
-        nombre_valido = "".join(c if c.isalnum() or c in " -_." else "_" for c in nombre_chat)
-        nombre_valido = nombre_valido.strip()
-        
-        if not nombre_valido:
-            nombre_valido = generar_nombre_por_defecto(mensajes)
-        
-        # Asegurarse de que la extensión sea .json
-        if not nombre_valido.lower().endswith('.json'):
-            nombre_valido += '.json'
-        
-        with open(os.path.join(CHATS_DIR, nombre_valido), "w", encoding="utf-8") as f:
-            json.dump(mensajes, f, ensure_ascii=False, indent=2)
+        almacen.guardar_chat(nombre_chat, mensajes, en_segundo_plano)
         return True
     except Exception as e:
         st.error(f"Error al guardar chat: {str(e)}")
         return False
 
 def cargar_chat(nombre_chat):
-    """Carga un chat desde un archivo JSON"""
+    """Carga un chat guardado"""
     try:
-        with open(os.path.join(CHATS_DIR, f"{nombre_chat}.json"), "r", encoding="utf-8") as f:
-            return json.load(f)
-    except FileNotFoundError:
-        st.error("Chat no encontrado")
-        return None
+        mensajes = almacen.cargar_chat(nombre_chat)
     except Exception as e:
         st.error(f"Error al cargar chat: {str(e)}")
         return None
+    if mensajes is None:
+        st.error("Chat no encontrado")
+    return mensajes
 
-def listar_chats():
-    """Lista todos los chats guardados"""
+def listar_chats_detalle(limite=None, desplazamiento=0):
+    """Devuelve los metadatos de una página de chats sin abrir ninguno de ellos"""
     try:
-        chats = [f.replace(".json", "") for f in os.listdir(CHATS_DIR) if f.endswith(".json")]
-        return sorted(chats, reverse=True)  # Más recientes primero
+        return almacen.listar_chats_detalle(limite, desplazamiento)
     except Exception as e:
         st.error(f"Error al listar chats: {str(e)}")
         return []
 
+def contar_chats():
+    """Cantidad de chats guardados"""
+    try:
+        return almacen.contar_chats()
+    except Exception as e:
+        st.error(f"Error al listar chats: {str(e)}")
+        return 0
+
+def buscar_chats(texto, limite=20):
+    """Busca en el contenido de todos los chats; devuelve los más relevantes con un fragmento"""
+    try:
+        return almacen.buscar_chats(texto, limite)
+    except Exception as e:
+        st.error(f"Error al buscar chats: {str(e)}")
+        return []
+
 def eliminar_chat(nombre_chat):
     """Elimina un chat guardado"""
     try:
-        os.remove(os.path.join(CHATS_DIR, f"{nombre_chat}.json"))
+        almacen.eliminar_chat(nombre_chat)
         return True
     except Exception as e:
         st.error(f"Error al eliminar chat: {str(e)}")
         return False
 
+# ==================== ADJUNTOS ====================
+
+# El texto de cada adjunto vive en el almacén por contenido de almacen.py; los
+# mensajes guardan solo su referencia y acá se arma lo que recibe el modelo
+
+def hash_subida(uploaded_file):
+    """sha256 de un archivo subido sin copiar sus bytes (Streamlit ya lo tiene en memoria).
+    
+    Se calcula una vez por subida: cada subida tiene su file_id y sus bytes no cambian
+    mientras sigue en el uploader, así que el hash queda en la sesión por file_id.
+    """
+    hashes = st.session_state.setdefault("hashes_subidas", {})
+    if uploaded_file.file_id not in hashes:
+        with uploaded_file.getbuffer() as vista:
+            hashes[uploaded_file.file_id] = hash_archivo(vista)
+    return hashes[uploaded_file.file_id]
+
+@st.cache_resource(max_entries=32)
+def obtener_indice_adjunto(hash_adjunto):
+    """Índice BM25 de un adjunto, que se arma una vez y se reusa en los turnos siguientes"""
+    # NumPy y SciPy se importan recién cuando hay un adjunto largo
+    from recuperacion import IndiceBM25
+    return IndiceBM25(leer_adjunto(hash_adjunto) or "")
+
+def texto_para_modelo(hash_adjunto, contenido, consulta, limite=LIMITE_CARACTERES_ADJUNTO, enviados=None):
+    """El adjunto entero si entra en el límite; si no, sus fragmentos más relevantes para la consulta.
+    
+    `enviados` son los índices de los fragmentos ya mandados (ver IndiceBM25.seleccionar).
+    """
+    if len(contenido) <= limite:
+        return contenido
+    return obtener_indice_adjunto(hash_adjunto).seleccionar(consulta, limite, enviados)
+
+def contenido_con_adjuntos(mensaje, ya_enviados=None, limite=None):
+    """Texto completo de un mensaje con el contenido de sus adjuntos, como se manda al modelo.
+    
+    Con `limite`, de cada adjunto más largo solo van los fragmentos más relevantes
+    para el texto del mensaje. `ya_enviados` (diccionario por hash) registra lo que
+    ya se mandó en la conversación: None si el adjunto fue entero, o el conjunto de
+    fragmentos elegidos. Un adjunto entero no se repite, solo se menciona; de uno
+    largo van los fragmentos relevantes para este mensaje que todavía no se mandaron,
+    así una pregunta nueva sobre el mismo archivo recibe sus propias partes.
+    """
+    adjuntos = mensaje.get("adjuntos")
+    if not adjuntos:
+        return mensaje["content"]
+    contexto_archivos = "\n\nContexto de archivos subidos:\n"
+    for adjunto in adjuntos:
+        encabezado = f"\n--- {adjunto['nombre']} ({adjunto['tipo']}) ---\n"
+        repetido = ya_enviados is not None and adjunto["hash"] in ya_enviados
+        if repetido and ya_enviados[adjunto["hash"]] is None:
+            contexto_archivos += f"{encabezado}(mismo contenido que el adjunto enviado antes)\n"
+            continue
+        contenido = leer_adjunto(adjunto["hash"])
+        if contenido is not None and limite and len(contenido) > limite:
+            enviados = ya_enviados.setdefault(adjunto["hash"], set()) if ya_enviados is not None else None
+            contenido = texto_para_modelo(adjunto["hash"], contenido, mensaje["content"], limite, enviados)
+            if repetido:
+                contenido = (f"(otras partes del adjunto enviado antes)\n{contenido}" if contenido
+                             else "(las partes relevantes ya se enviaron antes)")
+        elif ya_enviados is not None:
+            ya_enviados[adjunto["hash"]] = None
+        contexto_archivos += f"{encabezado}{contenido if contenido is not None else '(contenido no disponible)'}\n"
+    return f"{mensaje['content']}\n{contexto_archivos}"
+
+def construir_mensajes_api(mensajes):
+    """Mensajes en el formato de la API, con cada adjunto incluido una sola vez y solo en sus partes relevantes"""
+    ya_enviados = {}
+    return [
+        {"role": m["role"], "content": contenido_con_adjuntos(m, ya_enviados, LIMITE_CARACTERES_ADJUNTO)}
+        for m in mensajes
+    ]
+
+def exportar_mensajes(mensajes):
+    """Copia autocontenida del chat: las referencias a adjuntos se reemplazan por su texto"""
+    exportados = []
+    for mensaje in mensajes:
+        copia = {k: v for k, v in mensaje.items() if k != "adjuntos"}
+        copia["content"] = contenido_con_adjuntos(mensaje)
+        exportados.append(copia)
+    return exportados
+
+# ==================== CONTEXTO PARA EL MODELO ====================
+
+def estimar_tokens(texto):
+    """Tokens aproximados de un texto (sin el tokenizador de cada modelo)"""
+    return int(len(texto) / CARACTERES_POR_TOKEN) + 1
+
+def tokens_mensaje(mensaje):
+    """Tokens aproximados de un mensaje tal como se manda, con sus adjuntos recortados"""
+    return estimar_tokens(contenido_con_adjuntos(mensaje, limite=LIMITE_CARACTERES_ADJUNTO)) + TOKENS_POR_MENSAJE
+
+def presupuesto_contexto(modelo):
+    """Tokens de historial que se mandan a `modelo`: lo que deja libre su contexto, hasta PRESUPUESTO_CONTEXTO_TOKENS"""
+    contexto = CONTEXTO_MODELOS.get(modelo, CONTEXTO_POR_DEFECTO)
+    return min(contexto - MAX_TOKENS_RESPUESTA - TOKENS_RESUMEN, PRESUPUESTO_CONTEXTO_TOKENS)
+
+def ultimo_resumen(mensajes, modelo_comparado=None):
+    """(hasta, texto) del resumen guardado más reciente; (0, None) si todavía no hay.
+    
+    Con `modelo_comparado` se busca el resumen propio de ese modelo, que en el modo
+    comparación se guarda aparte del de la conversación (ver preparar_contexto).
+    """
+    for mensaje in reversed(mensajes):
+        if modelo_comparado:
+            guardado = mensaje.get("resumenes_comparacion", {}).get(modelo_comparado)
+        else:
+            guardado = mensaje.get("resumen_contexto")
+        if guardado:
+            return guardado["hasta"], guardado["texto"]
+    return 0, None
+
+def inicio_ventana(tokens, desde, presupuesto):
+    """Primer mensaje de la ventana más larga (desde el final, sin pasar de `desde`) que entra en `presupuesto`.
+    
+    El último mensaje entra siempre, aunque solo ya se pase.
+    """
+    inicio = len(tokens) - 1
+    usados = tokens[inicio]
+    while inicio > desde and usados + tokens[inicio - 1] <= presupuesto:
+        inicio -= 1
+        usados += tokens[inicio]
+    return inicio
+
+def resumir_conversacion(cliente, modelo, resumen_previo, mensajes):
+    """Resumen de `mensajes` que continúa `resumen_previo`, por tramos que entran en el contexto del modelo"""
+    resumen = resumen_previo
+    presupuesto = presupuesto_contexto(modelo)
+    tramo, usados = [], 0
+    for indice, mensaje in enumerate(construir_mensajes_api(mensajes)):
+        tramo.append(f"{mensaje['role']}: {mensaje['content']}")
+        usados += estimar_tokens(tramo[-1])
+        if indice == len(mensajes) - 1 or usados >= presupuesto // 2:
+            anterior = f"Resumen hasta ahora:\n{resumen}\n\n" if resumen else ""
+            respuesta = cliente.chat.completions.create(
+                model=modelo,
+                messages=[
+                    {"role": "system", "content": INSTRUCCION_RESUMEN},
+                    {"role": "user", "content": anterior + "Conversación:\n" + "\n\n".join(tramo)}
+                ],
+                temperature=0.2,
+                max_tokens=TOKENS_RESUMEN
+            )
+            resumen = respuesta.choices[0].message.content
+            tramo, usados = [], 0
+    return resumen
+
+def preparar_contexto(cliente, modelo, mensajes, comparado=False):
+    """Mensajes para la API que entran en el presupuesto de tokens de `modelo`.
+    
+    Los turnos más recientes van textuales; los anteriores se reemplazan por un
+    resumen. Cada resumen se calcula una sola vez y se guarda en el último mensaje
+    (en "resumen_contexto", con hasta qué mensaje cubre), así viaja con el chat.
+    Mientras la ventana desde el último resumen entra en el presupuesto se lo
+    reutiliza; cuando no, se resume el tramo siguiente a partir de él y la
+    ventana se achica a FRACCION_VENTANA del presupuesto para que los próximos
+    turnos no tengan que volver a resumir.
+    
+    Un modelo `comparado` tiene su propio presupuesto: su resumen se guarda en
+    "resumenes_comparacion", por modelo, y no reemplaza al de la conversación.
+    """
+    presupuesto = presupuesto_contexto(modelo)
+    hasta, resumen = ultimo_resumen(mensajes, modelo if comparado else None)
+    # Lo anterior al último resumen ya no se manda: no hace falta estimarlo
+    tokens = [0] * hasta + [tokens_mensaje(m) for m in mensajes[hasta:]]
+    if sum(tokens) > presupuesto:
+        corte = inicio_ventana(tokens, hasta, int(presupuesto * FRACCION_VENTANA))
+        # La ventana arranca en un mensaje del usuario, para no dejar una respuesta sin su pregunta
+        while corte < len(mensajes) - 1 and mensajes[corte]["role"] != "user":
+            corte += 1
+        if corte > hasta:
+            try:
+                with st.spinner("Resumiendo la parte anterior de la conversación..."):
+                    resumen = resumir_conversacion(cliente, modelo, resumen, mensajes[hasta:corte])
+                guardado = {"hasta": corte, "texto": resumen}
+                if comparado:
+                    mensajes[-1].setdefault("resumenes_comparacion", {})[modelo] = guardado
+                else:
+                    mensajes[-1]["resumen_contexto"] = guardado
+                hasta = corte
+            except Exception as e:
+                # Sin resumen nuevo se manda igual la ventana reciente, con el resumen anterior
+                st.warning(f"No se pudo resumir la conversación anterior: {str(e)}")
+                hasta = corte
+    api_messages = construir_mensajes_api(mensajes[hasta:])
+    if resumen:
+        api_messages.insert(0, {"role": "system", "content": f"Resumen de la conversación anterior:\n{resumen}"})
+    return api_messages
+
+# ==================== CACHÉ DE RESPUESTAS ====================
+
+def cache_respuestas_de_sesion():
+    """La caché de respuestas, o None si en esta sesión se eligió no usarla"""
+    if not st.session_state.get("usar_cache_respuestas", CACHE_RESPUESTAS_ACTIVA):
+        return None
+    return obtener_cache_respuestas()
+
+def mostrar_estadisticas_cache_respuestas():
+    cache = obtener_cache_respuestas()
+    tasa = cache.tasa_aciertos()
+    if tasa is None:
+        return
+    c = cache.contadores
+    st.caption(f"Caché de respuestas: {c['memoria'] + c['disco']} aciertos de "
+               f"{c['memoria'] + c['disco'] + c['fallos']} ({tasa:.0%}); ahorró "
+               f"{c['segundos_ahorrados']:.1f} s y {c['tokens_ahorrados']} tokens")
+
+# ==================== EXTRACCIÓN EN SEGUNDO PLANO ====================
+
+@st.cache_resource
+def obtener_grupo_extraccion():
+    """Grupo de procesos compartido por todas las sesiones para extraer archivos.
+    
+    Se usa "spawn" en todos los sistemas: es lo que hay en Windows y evita hacer
+    fork de un proceso con los hilos de Streamlit corriendo.
+    """
+    grupo = ProcessPoolExecutor(max_workers=EXTRACCION_PROCESOS, mp_context=multiprocessing.get_context("spawn"))
+    atexit.register(grupo.shutdown, wait=False, cancel_futures=True)
+    return grupo
+
+def reiniciar_grupo_extraccion():
+    """Descarta el grupo de procesos matando a sus procesos (p. ej. uno trabado con un archivo).
+    
+    Los demás trabajos que corrían o esperaban en él se reenvían solos al grupo
+    nuevo (ver TrabajoExtraccion._reenviar).
+    """
+    grupo = obtener_grupo_extraccion()
+    # Se olvida antes de cerrarlo, así los trabajos que se reenvían ya van al grupo nuevo
+    obtener_grupo_extraccion.clear()
+    # ProcessPoolExecutor no tiene forma pública de terminar sus procesos antes de Python 3.14
+    procesos = list((grupo._processes or {}).values())
+    grupo.shutdown(wait=False, cancel_futures=True)
+    for proceso in procesos:
+        proceso.terminate()
+
+@st.cache_resource
+def obtener_estado_extraccion():
+    """Diccionario donde los trabajos publican su avance y leen si se pidió cancelarlos.
+    
+    Con grupo de procesos es un dict servido por un Manager (un proceso más); si se
+    extrae en el mismo proceso alcanza con un dict común.
+    """
+    if EXTRACCION_PROCESOS == 0:
+        return {}
+    manager = multiprocessing.get_context("spawn").Manager()
+    atexit.register(manager.shutdown)
+    return manager.dict()
+
+def obtener_ejecutor_sesion():
+    """Hilo de la sesión que extrae en el mismo proceso cuando EXTRACCION_PROCESOS es 0"""
+    if "ejecutor_extraccion" not in st.session_state:
+        st.session_state.ejecutor_extraccion = ThreadPoolExecutor(max_workers=1, thread_name_prefix="extraccion")
+    return st.session_state.ejecutor_extraccion
+
+class TrabajoExtraccion:
+    """Extracción de un archivo que corre en segundo plano mientras la app sigue respondiendo.
+    
+    Los trabajos de cada sesión viven en st.session_state: en cada rerun se pregunta
+    si terminaron y, mientras tanto, se muestra su avance. Cancelar saca de la cola
+    a los que todavía no empezaron y a los que ya corren les pide cortar en la
+    próxima página, cuadro o bloque.
+    """
+    
+    def __init__(self, uploaded_file, extension, opciones):
+        self.id = uuid.uuid4().hex
+        self.nombre = uploaded_file.name
+        self.extension = extension
+        self.inicio = None
+        self.error = None
+        self.reiniciado = False
+        self.reenvios = 0
+        self._candado = threading.RLock()
+        self._origen, self.temporal = origen_extraccion(uploaded_file, extension)
+        self._opciones = opciones
+        ejecutor = obtener_ejecutor_sesion() if EXTRACCION_PROCESOS == 0 else obtener_grupo_extraccion()
+        self._enviar(ejecutor)
+    
+    def _enviar(self, ejecutor):
+        self.futuro = ejecutor.submit(extraer_con_avance, self._origen, self.extension, obtener_estado_extraccion(),
+                                      self.id, **self._opciones)
+        # También corre si el trabajo se abandona (p. ej. se quitó el archivo del uploader)
+        self.futuro.add_done_callback(self._terminado)
+    
+    def _terminado(self, futuro):
+        if not self._reenviar(futuro):
+            self._limpiar()
+    
+    def _reenviar(self, futuro):
+        """Vuelve a mandar el trabajo si `futuro` se perdió solo porque se reinició el grupo de procesos.
+        
+        Al reiniciarlo por un trabajo trabado se cortan también los que corrían o
+        esperaban en él, de esta sesión o de otras: esos arrancan de nuevo en el
+        grupo nuevo. Se llama desde el hilo del grupo al terminar `futuro` y desde
+        revisar(); devuelve si el trabajo sigue (reenviado ahora o antes).
+        """
+        with self._candado:
+            if futuro is not self.futuro:
+                return True
+            perdido = futuro.done() and (futuro.cancelled() or isinstance(futuro.exception(), BrokenProcessPool))
+            # Un trabajo cancelado o vencido tiene su error: ese no se reenvía
+            if not (perdido and EXTRACCION_PROCESOS and self.error is None and self.reenvios < EXTRACCION_REENVIOS):
+                return False
+            self.reenvios += 1
+            self.inicio = None
+            obtener_estado_extraccion().pop((self.id, "avance"), None)
+            self._enviar(obtener_grupo_extraccion())
+            return True
+    
+    def _limpiar(self):
+        self._origen = None
+        estado = obtener_estado_extraccion()
+        estado.pop((self.id, "avance"), None)
+        estado.pop((self.id, "cancelar"), None)
+        if self.temporal:
+            try:
+                os.unlink(self.temporal)
+            except OSError:
+                logger.warning("No se pudo borrar el temporal %s", self.temporal)
+    
+    def avance(self):
+        """(hechas, total) de la última página, cuadro o bloque terminado; total puede ser None"""
+        return obtener_estado_extraccion().get((self.id, "avance"), (0, None))
+    
+    def en_espera(self):
+        return not self.futuro.running() and not self.futuro.done()
+    
+    def cancelar(self, motivo=None):
+        with self._candado:
+            self.error = motivo or ExtraccionCancelada("extracción cancelada")
+            if not self.futuro.cancel():
+                obtener_estado_extraccion()[(self.id, "cancelar")] = True
+    
+    def revisar(self, timeout=EXTRACCION_TIMEOUT_SEG):
+        """Controla el tiempo de extracción y devuelve si el trabajo terminó.
+        
+        El tiempo se cuenta desde que un proceso lo toma, no desde que se encoló. Al
+        pasarse de `timeout` se le pide cortar; si está trabado dentro de una página
+        o del OCR y no corta en EXTRACCION_GRACIA_SEG más, se reinicia el grupo.
+        """
+        if self.futuro.done():
+            # Por si el hilo del grupo todavía no llegó a reenviarlo
+            self._reenviar(self.futuro)
+        if self.futuro.running():
+            ahora = time.monotonic()
+            self.inicio = self.inicio or ahora
+            if self.error is None and ahora - self.inicio > timeout:
+                self.cancelar(TimeoutError(f"la extracción tardó más de {timeout} s"))
+            elif (isinstance(self.error, TimeoutError) and EXTRACCION_PROCESOS and not self.reiniciado
+                    and ahora - self.inicio > timeout + EXTRACCION_GRACIA_SEG):
+                self.reiniciado = True
+                reiniciar_grupo_extraccion()
+        return self.futuro.done()
+    
+    def resultado(self):
+        """(extraido, error) de un trabajo terminado; si se canceló o venció, el error dice por qué"""
+        try:
+            return self.futuro.result(), None
+        except Exception as e:
+            return None, self.error or e
+
+def origen_extraccion(uploaded_file, extension):
+    """Qué se le pasa al extractor: los bytes del archivo o, si es grande, la ruta de una copia.
+    
+    La copia se hace por bloques desde el archivo subido, sin armar otra vez todos
+    sus bytes en memoria. Devuelve (origen, ruta temporal o None).
+    """
+    if uploaded_file.size <= EXTRACCION_EN_DISCO_BYTES:
+        return uploaded_file.getvalue(), None
+    uploaded_file.seek(0)
+    with tempfile.NamedTemporaryFile(delete=False, suffix=f'.{extension}') as tmp_file:
+        shutil.copyfileobj(uploaded_file, tmp_file, BLOQUE_COPIA_BYTES)
+    uploaded_file.seek(0)
+    return tmp_file.name, tmp_file.name
+
+def extraer_ahora(uploaded_file, extension, opciones):
+    """Extrae en el momento (sin trabajo en segundo plano); devuelve (extraido, error)"""
+    origen, temporal = origen_extraccion(uploaded_file, extension)
+    try:
+        return extraer_contenido(origen, extension, **opciones), None
+    except Exception as e:
+        return None, e
+    finally:
+        if temporal:
+            os.unlink(temporal)
+
+@st.fragment(run_every=EXTRACCION_REFRESCO_SEG)
+def mostrar_avance_extraccion():
+    """Avance de las extracciones de la sesión; se actualiza solo y, al terminar todas, recarga la app"""
+    trabajos = st.session_state.get("trabajos_extraccion", {})
+    if not trabajos:
+        return
+    if all([trabajo.revisar() for trabajo in trabajos.values()]):
+        st.rerun()
+    for trabajo in list(trabajos.values()):
+        texto, columna_boton = st.columns([6, 1])
+        hechas, total = trabajo.avance()
+        unidad = UNIDADES_AVANCE.get(extractor_de(trabajo.extension), "")
+        if trabajo.error is not None:
+            texto.caption(f"{trabajo.nombre}: cancelando...")
+        elif trabajo.en_espera():
+            texto.caption(f"{trabajo.nombre}: en espera")
+        elif total:
+            texto.progress(min(hechas / total, 1.0), text=f"{trabajo.nombre}: {hechas}/{total} {unidad}")
+        else:
+            texto.caption(f"{trabajo.nombre}: procesando... {f'{hechas} {unidad}' if hechas else ''}")
+        columna_boton.button("Cancelar", key=f"cancelar_{trabajo.id}", on_click=trabajo.cancelar,
+                             disabled=trabajo.error is not None)
+
 # ==================== FUNCIONES PRINCIPALES ====================
 
 def configurar_pagina():
@@ -136,70 +586,212 @@ def configurar_pagina():
     )
     st.title("💬 ChatBot con Historial de Chats")
 
+def precalentar_cliente_groq(cliente):
+    """Pide la lista de modelos para dejar una conexión abierta en el pool (no consume tokens)"""
+    try:
+        cliente.models.list()
+    except Exception as e:
+        logger.warning("No se pudo precalentar la conexión con Groq: %s", e)
+
+@st.cache_resource
+def obtener_grupo_comparacion():
+    """Hilos que hacen los pedidos del modo comparación (comparten el pool de conexiones del cliente)"""
+    grupo = ThreadPoolExecutor(max_workers=COMPARACION_HILOS, thread_name_prefix="comparacion")
+    atexit.register(grupo.shutdown, wait=False, cancel_futures=True)
+    return grupo
+
+@st.cache_resource
+def obtener_cliente_groq(api_key):
+    """Cliente de Groq compartido por todas las sesiones, con su pool de conexiones.
+    
+    Crear un cliente por ejecución del script abría conexiones nuevas (y un saludo
+    TLS) en cada mensaje. httpx.Client es seguro entre hilos, así que las sesiones,
+    cada una en su hilo, toman conexiones del mismo pool. Se guarda por API key:
+    si cambia el secret se crea otro cliente.
+    """
+    http_client = httpx.Client(
+        limits=httpx.Limits(max_connections=GROQ_CONEXIONES_MAXIMAS,
+                            max_keepalive_connections=GROQ_CONEXIONES_VIVAS,
+                            keepalive_expiry=GROQ_KEEPALIVE_SEG),
+        timeout=httpx.Timeout(GROQ_TIMEOUT_LECTURA_SEG, connect=GROQ_TIMEOUT_CONEXION_SEG),
+        follow_redirects=True
+    )
+    cliente = groq.Groq(api_key=api_key, http_client=http_client, max_retries=GROQ_REINTENTOS,
+                        timeout=http_client.timeout)
+    atexit.register(http_client.close)
+    if GROQ_PRECALENTAR:
+        threading.Thread(target=precalentar_cliente_groq, args=(cliente,), name="precalentar-groq",
+                         daemon=True).start()
+    return cliente
+
 def crear_cliente_groq():
     try:
         groq_api_key = st.secrets.get("GROQ_API_KEY")
         if not groq_api_key:
             st.error("API key no configurada. Por favor configura GROQ_API_KEY en los secrets.")
             st.stop()
-        return groq.Groq(api_key=groq_api_key)
+        return obtener_cliente_groq(groq_api_key)
     except Exception as e:
         st.error(f"Error al crear cliente Groq: {str(e)}")
         st.stop()
 
-def procesar_archivo(uploaded_file):
-    try:
-        file_extension = uploaded_file.name.split('.')[-1].lower()
-        
-        with tempfile.NamedTemporaryFile(delete=False, suffix=f'.{file_extension}') as tmp_file:
-            tmp_file.write(uploaded_file.getvalue())
-            tmp_file_path = tmp_file.name
-        
-        contenido = ""
-        
-        if file_extension in EXTENSIONES_PERMITIDAS['imagen']:
-            imagen = Image.open(tmp_file_path)
-            contenido = pytesseract.image_to_string(imagen)
-            st.image(imagen, caption=f"Imagen subida: {uploaded_file.name}", use_column_width=True)
-            
-        elif file_extension == 'pdf':
-            contenido = extract_text(tmp_file_path)
-            st.success(f"PDF procesado: {uploaded_file.name} (páginas: {len(contenido.split('\x0c'))})")
-            
-        elif file_extension == 'docx':
-            doc = Document(tmp_file_path)
-            contenido = '\n'.join([para.text for para in doc.paragraphs])
-            st.success(f"Documento Word procesado: {uploaded_file.name}")
-            
-        elif file_extension in ['xlsx', 'xls']:
-            df = pd.read_excel(tmp_file_path)
-            contenido = f"Datos tabulares:\n{df.to_string()}"
-            st.dataframe(df.head())
-            
-        elif file_extension == 'csv':
-            df = pd.read_csv(tmp_file_path)
-            contenido = f"Datos CSV:\n{df.to_string()}"
-            st.dataframe(df.head())
-            
+def mostrar_vista_previa(uploaded_file, extension, extraido, paginas=None):
+    """Muestra el archivo procesado a partir de lo extraído (o de la caché).
+    
+    `paginas` son las páginas elegidas de un PDF (índices desde 0), si se eligieron.
+    """
+    extractor = extractor_de(extension)
+    if extractor == "imagen":
+        cuadros = f" ({extraido['cuadros']} cuadros)" if extraido.get("cuadros", 1) > 1 else ""
+        st.image(uploaded_file, caption=f"Imagen subida: {uploaded_file.name}{cuadros}", use_column_width=True)
+    elif extractor == "pdf":
+        total, leidas = extraido["paginas"], extraido["paginas_leidas"]
+        detalle = f"páginas: {total}" if total is not None else "cantidad de páginas desconocida"
+        if paginas is not None:
+            detalle += f", leídas: {describir_paginas(paginas[:leidas])}"
+        elif total is None or leidas < total:
+            detalle += f", leídas: {leidas}"
+        if extraido.get("limite_alcanzado") and (paginas is not None or leidas != total):
+            detalle += " hasta completar el límite de texto"
+        st.success(f"PDF procesado: {uploaded_file.name} ({detalle})")
+    elif extractor == "docx":
+        st.success(f"Documento Word procesado: {uploaded_file.name}")
+    elif "vista" in extraido:
+        import pandas as pd
+        st.dataframe(pd.read_json(io.StringIO(extraido["vista"]), orient="split"))
+    elif extension in EXTENSIONES_PERMITIDAS['codigo']:
+        st.code(extraido["contenido"], language=extension)
+    else:
+        st.text_area(f"Contenido de {uploaded_file.name}", extraido["contenido"], height=200)
+    if extraido.get("parcial"):
+        st.warning(f"{uploaded_file.name} es muy grande: se procesó solo una parte ({extraido['parcial']})")
+
+def paginas_elegidas(texto):
+    """Convierte un rango como "1-5, 8" en índices de página desde 0; None si está vacío.
+    
+    Cada rango necesita sus dos extremos: "3-" no se acepta, porque sin leer el PDF
+    no se sabe dónde termina.
+    """
+    if not texto.strip():
+        return None
+    paginas = set()
+    for parte in texto.split(","):
+        desde, guion, hasta = parte.strip().partition("-")
+        if guion and not hasta:
+            raise ValueError(f"falta la última página del rango {parte.strip()!r}")
+        if (not desde.isdigit() or (guion and not hasta.isdigit()) or int(desde) < 1
+                or int(hasta or desde) < int(desde)):
+            raise ValueError(f"rango de páginas inválido: {parte.strip()!r}")
+        paginas.update(range(int(desde) - 1, int(hasta or desde)))
+    # extract_pages toma una lista vacía como "todas las páginas"
+    if not paginas:
+        raise ValueError(f"rango de páginas inválido: {texto.strip()!r}")
+    return sorted(paginas)
+
+def describir_paginas(paginas):
+    """Lo inverso de paginas_elegidas: índices desde 0 escritos como rangos, p. ej. 1-5, 8"""
+    rangos = []
+    for pagina in paginas:
+        if rangos and rangos[-1][1] == pagina:
+            rangos[-1][1] = pagina + 1
         else:
-            with open(tmp_file_path, 'r', encoding='utf-8') as f:
-                contenido = f.read()
-            if file_extension in EXTENSIONES_PERMITIDAS['codigo']:
-                st.code(contenido, language=file_extension)
-            else:
-                st.text_area(f"Contenido de {uploaded_file.name}", contenido, height=200)
+            rangos.append([pagina + 1, pagina + 1])
+    return ", ".join(str(desde) if desde == hasta else f"{desde}-{hasta}" for desde, hasta in rangos)
+
+def procesar_archivos(uploaded_files):
+    """Procesa los archivos subidos y devuelve los que ya se pudieron leer, en el orden de subida.
+    
+    En cada rerun los archivos siguen en el uploader: los que ya están en la caché
+    no se vuelven a extraer, los de texto se leen en el momento y el resto se
+    manda a extraer en segundo plano. Mientras tanto la app sigue respondiendo
+    (se puede chatear; esos archivos todavía no se adjuntan) y el resultado se
+    recoge en el rerun que sigue a que termine. Un archivo que falló o se canceló
+    no se vuelve a intentar hasta pedirlo.
+    """
+    cache = obtener_cache_extraccion()
+    trabajos = st.session_state.setdefault("trabajos_extraccion", {})
+    fallidas = st.session_state.setdefault("extracciones_fallidas", {})
+    archivos = []
+    for uploaded_file in uploaded_files:
+        extension = uploaded_file.name.split('.')[-1].lower()
+        hash_datos = hash_subida(uploaded_file)
+        lugar = st.container()
+        opciones = {}
+        variante = ""
+        if extractor_de(extension) == "pdf":
+            rango = lugar.text_input(f"Páginas de {uploaded_file.name} (p. ej. 1-5, 8; vacío = desde el principio)",
+                                     key=f"paginas_{hash_datos}")
+            try:
+                opciones["paginas"] = paginas_elegidas(rango)
+            except ValueError as e:
+                lugar.warning(f"{str(e)}; se lee desde el principio")
+                opciones["paginas"] = None
+            if opciones["paginas"] is not None:
+                variante = f"paginas={opciones['paginas']}"
+        clave = cache.clave(hash_datos, extension, variante)
+        extraido = cache.obtener(clave)
         
-        os.unlink(tmp_file_path)
+        if extraido is None and clave in trabajos and trabajos[clave].revisar():
+            extraido, error = trabajos.pop(clave).resultado()
+            if error:
+                fallidas[clave] = error
+            else:
+                cache.guardar(clave, extraido)
+        elif extraido is None and clave not in trabajos and clave not in fallidas:
+            if obtener_extractor(extension).costo == COSTO_BAJO:
+                extraido, error = extraer_ahora(uploaded_file, extension, opciones)
+                if error:
+                    fallidas[clave] = error
+                else:
+                    cache.guardar(clave, extraido)
+            else:
+                trabajos[clave] = TrabajoExtraccion(uploaded_file, extension, opciones)
         
-        return {
-            "nombre": uploaded_file.name,
-            "tipo": file_extension,
-            "contenido": contenido[:10000]
+        with lugar:
+            if extraido is not None:
+                mostrar_vista_previa(uploaded_file, extension, extraido, opciones.get("paginas"))
+            elif clave in fallidas:
+                if isinstance(fallidas[clave], ExtraccionCancelada):
+                    st.warning(f"Se canceló el procesamiento de {uploaded_file.name}")
+                else:
+                    st.error(f"Error al procesar {uploaded_file.name}: {str(fallidas[clave])}")
+                st.button("Reintentar", key=f"reintentar_{clave}", on_click=fallidas.pop, args=(clave, None))
+            else:
+                st.caption(f"Procesando {uploaded_file.name}; se podrá adjuntar cuando termine")
+        archivos.append({"archivo": uploaded_file, "extension": extension, "clave": clave, "extraido": extraido})
+    
+    # Los trabajos de archivos que ya no están en el uploader (o con otro rango de páginas) se cancelan
+    vigentes = {a["clave"] for a in archivos}
+    for clave in list(trabajos):
+        if clave not in vigentes:
+            trabajos.pop(clave).cancelar()
+    for clave in list(fallidas):
+        if clave not in vigentes:
+            del fallidas[clave]
+    hashes = st.session_state.get("hashes_subidas", {})
+    for file_id in set(hashes) - {uploaded_file.file_id for uploaded_file in uploaded_files}:
+        del hashes[file_id]
+    if trabajos:
+        mostrar_avance_extraccion()
+    
+    return [
+        {
+            "nombre": a["archivo"].name,
+            "tipo": a["extension"],
+            # El texto de solo algunas páginas o de otra versión del extractor es otro adjunto
+            "hash": clave_adjunto(a["clave"]),
+            "contenido": a["extraido"]["contenido"]
         }
-        
-    except Exception as e:
-        st.error(f"Error al procesar archivo: {str(e)}")
-        return None
+        for a in archivos if a["extraido"] is not None
+    ]
+
+def etiqueta_chat(chat):
+    """Texto con el que se muestra un chat guardado en la barra lateral"""
+    partes = [chat["titulo"] or chat["nombre"]]
+    if "mensajes" in chat:
+        partes.append(f"{chat['mensajes']} mensajes")
+    partes.append(datetime.fromisoformat(chat["ultimo_ts"]).strftime('%d/%m %H:%M'))
+    return " · ".join(partes)
 
 def mostrar_sidebar():
     with st.sidebar:
@@ -212,15 +804,53 @@ def mostrar_sidebar():
             format_func=lambda x: f"{x} - {MODELOS[x]}",
             index=0
         )
+        # Un modelo recién elegido arriba sale de la comparación (ya no es una de las opciones)
+        if modelo in st.session_state.get("modelos_comparacion", []):
+            st.session_state.modelos_comparacion = [m for m in st.session_state.modelos_comparacion if m != modelo]
+        st.multiselect(
+            "Comparar con",
+            options=[m for m in MODELOS if m != modelo],
+            key="modelos_comparacion",
+            help="La pregunta se manda a la vez a estos modelos y las respuestas se muestran lado a lado. "
+                 "La conversación sigue con la respuesta del modelo seleccionado."
+        )
+        st.toggle(
+            "Reutilizar respuestas guardadas",
+            value=CACHE_RESPUESTAS_ACTIVA,
+            key="usar_cache_respuestas",
+            help="Si ya se respondió la misma pregunta, con el mismo historial y modelo, se muestra esa "
+                 "respuesta sin volver a consultar a Groq. Desactivarlo para pedir una respuesta nueva."
+        )
+        mostrar_estadisticas_cache_respuestas()
         
         st.divider()
         st.subheader("📚 Gestión de Chats")
         
-        # Lista de chats guardados con búsqueda
-        chats_guardados = listar_chats()
+        # Lista de chats guardados con búsqueda en su contenido
+        busqueda = st.text_input("🔎 Buscar en los chats", key="busqueda_chats")
+        if busqueda:
+            resultados = buscar_chats(busqueda)
+            detalles = {chat["nombre"]: chat for chat in resultados}
+            if not resultados:
+                st.caption("Sin resultados")
+            for chat in resultados[:5]:
+                st.caption(f"**{chat['titulo'] or chat['nombre']}**: {chat['fragmento']}")
+        else:
+            # Sin búsqueda: paginada y ordenada por última actividad
+            total_chats = contar_chats()
+            paginas = max(1, -(-total_chats // CHATS_POR_PAGINA))
+            pagina = 1
+            if paginas > 1:
+                pagina = st.number_input(f"Página (de {paginas})", min_value=1, max_value=paginas, value=1)
+            detalles = {
+                chat["nombre"]: chat
+                for chat in listar_chats_detalle(CHATS_POR_PAGINA, (pagina - 1) * CHATS_POR_PAGINA)
+            }
+        chats_guardados = list(detalles)
         chat_seleccionado = st.selectbox(
             "Chats guardados",
             options=chats_guardados,
+            format_func=lambda x: etiqueta_chat(detalles[x]),
             index=0 if chats_guardados else None,
             key="chat_seleccionado"
         )
@@ -230,7 +860,8 @@ def mostrar_sidebar():
         with col1:
             if st.button("💾 Guardar chat", help="Guarda el chat actual"):
                 if hasattr(st.session_state, 'mensajes') and st.session_state.mensajes:
-                    nombre_por_defecto = generar_nombre_por_defecto(st.session_state.mensajes)
+                    nombre_por_defecto = (st.session_state.current_chat_name
+                                          or generar_nombre_por_defecto(st.session_state.mensajes))
                     nombre_chat = st.text_input(
                         "Nombre para este chat:",
                         value=nombre_por_defecto,
@@ -282,17 +913,28 @@ def mostrar_sidebar():
         st.divider()
         st.subheader("🔄 Importar/Exportar")
         
-        # Exportar chat actual
+        # Exportar chat actual: el JSON lleva el texto de todos los adjuntos, así que se
+        # arma solo cuando se pide y se guarda mientras el chat no cambie
         if hasattr(st.session_state, 'mensajes') and st.session_state.mensajes:
-            chat_json = json.dumps(st.session_state.mensajes, ensure_ascii=False, indent=2)
-            nombre_exportacion = f"{st.session_state.current_chat_name or 'chat_exportado'}.json"
-            st.download_button(
-                label="📤 Exportar chat actual",
-                data=chat_json,
-                file_name=nombre_exportacion,
-                mime="application/json",
-                help="Descarga el chat actual como archivo JSON"
-            )
+            version_chat = (st.session_state.current_chat_name, len(st.session_state.mensajes),
+                            st.session_state.mensajes[-1].get("timestamp"))
+            exportacion = st.session_state.get("exportacion_chat")
+            if exportacion is not None and exportacion[0] != version_chat:
+                exportacion = st.session_state.exportacion_chat = None
+            if exportacion is None and st.button("📤 Preparar exportación",
+                                                 help="Arma el archivo JSON del chat actual para descargarlo"):
+                with st.spinner("Preparando exportación..."):
+                    chat_json = json.dumps(exportar_mensajes(st.session_state.mensajes), ensure_ascii=False, indent=2)
+                exportacion = st.session_state.exportacion_chat = (version_chat, chat_json)
+            if exportacion is not None:
+                nombre_exportacion = f"{st.session_state.current_chat_name or 'chat_exportado'}.json"
+                st.download_button(
+                    label="📤 Exportar chat actual",
+                    data=exportacion[1],
+                    file_name=nombre_exportacion,
+                    mime="application/json",
+                    help="Descarga el chat actual como archivo JSON"
+                )
         
         # Importar chat
         uploaded_chat = st.file_uploader(
@@ -305,7 +947,8 @@ def mostrar_sidebar():
         if uploaded_chat:
             try:
                 mensajes = json.load(uploaded_chat)
-                if isinstance(mensajes, list) and all("role" in msg and "content" in msg for msg in mensajes):
+                # Mismo chequeo que la importación del zip: los hashes de adjuntos se validan
+                if es_chat_valido(mensajes):
                     st.session_state.mensajes = mensajes
                     nombre_archivo = uploaded_chat.name.replace(".json", "")
                     st.session_state.current_chat_name = nombre_archivo
@@ -317,6 +960,24 @@ def mostrar_sidebar():
             except Exception as e:
                 st.error(f"Error al importar chat: {str(e)}")
         
+        # Importar un historial completo exportado con herramientas.py exportar
+        uploaded_zip = st.file_uploader(
+            "📦 Importar historial (ZIP)",
+            type=["zip"],
+            accept_multiple_files=False,
+            help="Sube un ZIP generado con 'python herramientas.py exportar'"
+        )
+        if uploaded_zip and st.session_state.get("zip_importado") != uploaded_zip.file_id:
+            try:
+                with st.spinner("Importando chats..."):
+                    resumen = importar_archivo_chats(uploaded_zip)
+                st.session_state.zip_importado = uploaded_zip.file_id
+                st.success(f"Chats importados: {resumen['importados']} (renombrados: {resumen['renombrados']})")
+                for error in resumen["errores"][:5]:
+                    st.warning(error)
+            except Exception as e:
+                st.error(f"Error al importar historial: {str(e)}")
+        
         st.divider()
         st.markdown('ℹ️ **Formatos soportados:**')
         st.markdown('- **Imágenes:** PNG, JPG, JPEG, SVG, BMP, GIF')
@@ -341,34 +1002,219 @@ def obtener_mensajes_previos():
     if hasattr(st.session_state, 'mensajes'):
         for mensaje in st.session_state.mensajes:
             with st.chat_message(mensaje["role"]):
-                st.markdown(mensaje["content"])
+                if mensaje.get("comparacion"):
+                    mostrar_comparacion(mensaje)
+                else:
+                    st.markdown(mensaje["content"])
                 if "archivos" in mensaje and mensaje["archivos"]:
                     st.caption(f"Archivos adjuntos: {', '.join(mensaje['archivos'])}")
                 if "timestamp" in mensaje:
-                    st.caption(f"{datetime.fromisoformat(mensaje['timestamp']).strftime('%H:%M')}")
+                    # En una comparación los tiempos van en el pie de cada columna
+                    detalle = "" if mensaje.get("comparacion") else detalle_respuesta(mensaje)
+                    st.caption(f"{datetime.fromisoformat(mensaje['timestamp']).strftime('%H:%M')}{detalle}")
+
+def detalle_respuesta(mensaje):
+    """Tiempos de una respuesta (y si se cortó) para el pie del mensaje"""
+    detalle = ""
+    tiempos = mensaje.get("tiempos") or {}
+    if tiempos.get("primer_token") is not None:
+        detalle += f" • primer token en {tiempos['primer_token']:.1f} s"
+    if tiempos.get("cache"):
+        detalle += " • desde la caché"
+    elif tiempos.get("total") is not None:
+        detalle += f" • {tiempos['total']:.1f} s en total"
+    if mensaje.get("interrumpida"):
+        detalle += " • respuesta interrumpida"
+    return detalle
+
+def pedir_respuesta(cliente, modelo, api_messages, cache):
+    """Respuesta completa de `modelo` (o la guardada en `cache`); devuelve (texto, tokens, tiempos).
+    
+    No usa Streamlit, así que se puede llamar desde otro hilo.
+    """
+    inicio = time.perf_counter()
+    clave = CacheRespuestas.clave(modelo, api_messages, TEMPERATURA, MAX_TOKENS_RESPUESTA)
+    guardada = cache.obtener(clave) if cache else None
+    if guardada:
+        return guardada["contenido"], None, {"total": round(time.perf_counter() - inicio, 3), "cache": True}
+    respuesta = cliente.chat.completions.create(
+        model=modelo,
+        messages=api_messages,
+        stream=False,
+        temperature=TEMPERATURA,
+        max_tokens=MAX_TOKENS_RESPUESTA
+    )
+    tiempos = {"total": round(time.perf_counter() - inicio, 3)}
+    contenido, tokens = respuesta.choices[0].message.content, uso_tokens(respuesta.usage)
+    if cache and contenido:
+        cache.guardar(clave, modelo, contenido, tokens, tiempos["total"])
+    return contenido, tokens, tiempos
 
 def obtener_respuesta_modelo(cliente, modelo, mensajes):
+    """Pide la respuesta completa de una vez (o la toma de la caché); devuelve (texto, tokens, tiempos)"""
     try:
         with st.spinner(f"Analizando con {modelo}..."):
-            api_messages = [{"role": m["role"], "content": m["content"]} for m in mensajes]
-            respuesta = cliente.chat.completions.create(
+            api_messages = preparar_contexto(cliente, modelo, mensajes)
+            return pedir_respuesta(cliente, modelo, api_messages, cache_respuestas_de_sesion())
+    except Exception as e:
+        st.error(f"Error al obtener respuesta: {str(e)}")
+        return None, None, None
+
+def transmitir_respuesta_modelo(cliente, modelo, mensajes, guardar):
+    """Pide la respuesta en modo streaming y la muestra a medida que llegan los tokens.
+    
+    Al terminar, o si se corta, llama a `guardar(texto, tokens, tiempos, completa)`
+    con lo generado. El botón "Detener" (como cualquier otra interacción) hace que
+    Streamlit corte el script en el próximo redibujado: el finally cierra la
+    conexión, lo que cancela la generación en Groq, y guarda la parte recibida.
+    Los tiempos son hasta el primer token y total, en segundos.
+    """
+    destino = st.empty()
+    control = st.empty()
+    destino.caption(f"Analizando con {modelo}...")
+    control.button("⏹ Detener", key="detener_respuesta")
+    partes = []
+    tiempos = {}
+    uso = None
+    completa = False
+    stream = None
+    inicio = time.perf_counter()
+    try:
+        api_messages = preparar_contexto(cliente, modelo, mensajes)
+        # Los tiempos se cuentan desde el pedido, sin el resumen del historial si hizo falta
+        inicio = time.perf_counter()
+        cache = cache_respuestas_de_sesion()
+        clave = CacheRespuestas.clave(modelo, api_messages, TEMPERATURA, MAX_TOKENS_RESPUESTA)
+        guardada = cache.obtener(clave) if cache else None
+        if guardada:
+            partes.append(guardada["contenido"])
+            tiempos["cache"] = True
+        else:
+            stream = cliente.chat.completions.create(
                 model=modelo,
                 messages=api_messages,
-                stream=False,
-                temperature=0.7,
-                max_tokens=2048
+                stream=True,
+                temperature=TEMPERATURA,
+                max_tokens=MAX_TOKENS_RESPUESTA
             )
-            return respuesta.choices[0].message.content
+            ultimo_dibujo = 0
+            for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    if not partes:
+                        tiempos["primer_token"] = round(time.perf_counter() - inicio, 3)
+                    partes.append(chunk.choices[0].delta.content)
+                    if time.perf_counter() - ultimo_dibujo >= REFRESCO_STREAMING_SEG:
+                        destino.markdown("".join(partes) + "▌")
+                        ultimo_dibujo = time.perf_counter()
+                # Groq manda el uso de tokens en el último fragmento
+                extra = getattr(chunk, "x_groq", None)
+                uso = chunk.usage or (extra.usage if extra else None) or uso
+            if cache and partes:
+                cache.guardar(clave, modelo, "".join(partes), uso_tokens(uso), round(time.perf_counter() - inicio, 3))
+        completa = True
     except Exception as e:
         st.error(f"Error al obtener respuesta: {str(e)}")
+    finally:
+        if stream is not None:
+            stream.close()
+        tiempos["total"] = round(time.perf_counter() - inicio, 3)
+        texto = "".join(partes)
+        if texto:
+            guardar(texto, uso_tokens(uso), tiempos, completa)
+    control.empty()
+    destino.markdown(texto)
+    return texto or None
+
+def detalle_comparacion(respuesta):
+    """Latencia y tokens de una de las respuestas de una comparación"""
+    detalle = detalle_respuesta(respuesta)
+    tokens = respuesta.get("tokens")
+    if tokens:
+        detalle += f" • {tokens['prompt']} + {tokens['respuesta']} tokens"
+    return detalle.removeprefix(" • ")
+
+def mostrar_respuesta_comparada(respuesta):
+    st.markdown(respuesta["content"])
+    st.caption(detalle_comparacion(respuesta))
+
+def mostrar_comparacion(mensaje):
+    """Respuestas de una comparación lado a lado: la que sigue la conversación y las de los otros modelos"""
+    respuestas = [mensaje, *mensaje["comparacion"]]
+    for columna, respuesta in zip(st.columns(len(respuestas)), respuestas):
+        with columna:
+            st.markdown(f"**{respuesta['model']}**")
+            mostrar_respuesta_comparada(respuesta)
+
+def comparar_modelos(cliente, modelos, mensajes, guardar):
+    """Manda la conversación a todos los `modelos` a la vez y muestra cada respuesta en su columna al llegar.
+    
+    El contexto de cada modelo (con su propio presupuesto de tokens) se arma en el
+    hilo del script y el pedido se hace en los hilos de obtener_grupo_comparacion,
+    que no tocan Streamlit. El primer modelo es el de la conversación; los demás
+    guardan su resumen aparte (ver preparar_contexto), así uno de contexto chico
+    no pisa el resumen de la conversación ni vuelve a resumir en cada turno. La
+    primera respuesta obtenida en el orden de `modelos` sigue la conversación y
+    las demás van en su "comparacion": al terminar, o si la ejecución se corta,
+    se llama a `guardar(texto, tokens, tiempos, modelo_respuesta=...,
+    comparacion=[...])` con las que llegaron.
+    """
+    huecos = {}
+    for columna, modelo in zip(st.columns(len(modelos)), modelos):
+        with columna:
+            st.markdown(f"**{modelo}**")
+            huecos[modelo] = st.empty()
+            huecos[modelo].caption("Esperando respuesta...")
+    cache = cache_respuestas_de_sesion()
+    grupo = obtener_grupo_comparacion()
+    futuros = {}
+    respuestas = {}
+    try:
+        # Cada pedido sale apenas está su contexto, sin esperar a armar el de los demás
+        for modelo in modelos:
+            api_messages = preparar_contexto(cliente, modelo, mensajes, comparado=modelo != modelos[0])
+            futuros[grupo.submit(pedir_respuesta, cliente, modelo, api_messages, cache)] = modelo
+        for futuro in as_completed(futuros):
+            modelo = futuros[futuro]
+            try:
+                contenido, tokens, tiempos = futuro.result()
+            except Exception as e:
+                huecos[modelo].error(f"Error al obtener respuesta: {str(e)}")
+                continue
+            if not contenido:
+                huecos[modelo].warning("El modelo no devolvió texto")
+                continue
+            respuesta = {"model": modelo, "content": contenido, "tiempos": tiempos}
+            if tokens:
+                respuesta["tokens"] = tokens
+            respuestas[modelo] = respuesta
+            with huecos[modelo].container():
+                mostrar_respuesta_comparada(respuesta)
+    except Exception as e:
+        st.error(f"Error al obtener respuesta: {str(e)}")
+    finally:
+        obtenidas = [respuestas[modelo] for modelo in modelos if modelo in respuestas]
+        if obtenidas:
+            principal, *otras = obtenidas
+            guardar(principal["content"], principal.get("tokens"), principal["tiempos"],
+                    modelo_respuesta=principal["model"], comparacion=otras)
+    return obtenidas
+
+def uso_tokens(uso):
+    """Tokens informados por la API, en el formato en que se guardan con el mensaje"""
+    if uso is None:
         return None
+    return {"prompt": uso.prompt_tokens, "respuesta": uso.completion_tokens}
 
 def autoguardar_chat():
     """Guarda automáticamente el chat si tiene suficientes mensajes"""
     if hasattr(st.session_state, 'mensajes') and len(st.session_state.mensajes) > 2:
         if not hasattr(st.session_state, 'current_chat_name') or not st.session_state.current_chat_name:
             st.session_state.current_chat_name = generar_nombre_por_defecto(st.session_state.mensajes)
-        guardar_chat(st.session_state.current_chat_name, st.session_state.mensajes)
+        # Un error de un guardado anterior en segundo plano se muestra ahora
+        error = obtener_escritor().tomar_error(st.session_state.current_chat_name)
+        if error:
+            st.error(f"Error al guardar chat: {str(error)}")
+        guardar_chat(st.session_state.current_chat_name, st.session_state.mensajes, en_segundo_plano=True)
 
 def ejecutar_chat():
     # 1. Inicializar estado del chat (PRIMERO)
@@ -376,6 +1222,7 @@ def ejecutar_chat():
     
     # 2. Configurar página y cliente
     configurar_pagina()
+    programar_archivado()
     cliente = crear_cliente_groq()
     
     # 3. Mostrar sidebar (que ahora puede acceder a mensajes con seguridad)
@@ -388,35 +1235,28 @@ def ejecutar_chat():
         accept_multiple_files=True
     )
     
-    # Procesar archivos subidos
-    archivos_procesados = []
-    if uploaded_files:
-        for uploaded_file in uploaded_files:
-            with st.spinner(f"Procesando {uploaded_file.name}..."):
-                archivo_procesado = procesar_archivo(uploaded_file)
-                if archivo_procesado:
-                    archivos_procesados.append(archivo_procesado)
+    # Procesar archivos subidos (también sin archivos: cancela lo que quedó extrayéndose)
+    archivos_procesados = procesar_archivos(uploaded_files or [])
     
     # Mostrar historial de chat
     obtener_mensajes_previos()
     
     # Campo de entrada de mensaje
     if prompt := st.chat_input("Escribe tu mensaje o pregunta sobre los archivos..."):
-        # Construir contexto con archivos si existen
-        contexto_archivos = ""
-        if archivos_procesados:
-            contexto_archivos = "\n\nContexto de archivos subidos:\n"
-            for archivo in archivos_procesados:
-                contexto_archivos += f"\n--- {archivo['nombre']} ({archivo['tipo']}) ---\n{archivo['contenido']}\n"
-        
-        mensaje_completo = f"{prompt}\n{contexto_archivos}"
+        # Los archivos se guardan una vez por contenido y el mensaje solo los referencia
+        for archivo in archivos_procesados:
+            guardar_adjunto(archivo['hash'], archivo['contenido'])
         
         user_msg = {
             "role": "user",
-            "content": mensaje_completo,
+            "content": prompt,
             "timestamp": datetime.now().isoformat(),
             "archivos": [a['nombre'] for a in archivos_procesados]
         }
+        if archivos_procesados:
+            user_msg["adjuntos"] = [
+                {"hash": a['hash'], "nombre": a['nombre'], "tipo": a['tipo']} for a in archivos_procesados
+            ]
         st.session_state.mensajes.append(user_msg)
         
         with st.chat_message("user"):
@@ -425,23 +1265,44 @@ def ejecutar_chat():
                 st.caption(f"Archivos adjuntos: {', '.join([a['nombre'] for a in archivos_procesados])}")
             st.caption(f"{datetime.now().strftime('%H:%M')}")
         
-        respuesta = obtener_respuesta_modelo(cliente, modelo, st.session_state.mensajes)
-        
-        if respuesta:
+        def guardar_respuesta(respuesta, tokens, tiempos, completa=True, modelo_respuesta=modelo, comparacion=None):
             assistant_msg = {
                 "role": "assistant",
                 "content": respuesta,
                 "timestamp": datetime.now().isoformat(),
-                "model": modelo
+                "model": modelo_respuesta
             }
+            if tokens:
+                assistant_msg["tokens"] = tokens
+            if tiempos:
+                assistant_msg["tiempos"] = tiempos
+            if not completa:
+                assistant_msg["interrumpida"] = True
+            if comparacion:
+                # Las respuestas de los otros modelos se guardan pero no vuelven a mandarse
+                assistant_msg["comparacion"] = comparacion
             st.session_state.mensajes.append(assistant_msg)
-            
-            with st.chat_message("assistant"):
-                st.markdown(respuesta)
-                st.caption(f"{datetime.now().strftime('%H:%M')} • {modelo}")
-            
-            # Autoguardar después de cada interacción completa
+            # Autoguardar después de cada interacción, también si la respuesta se cortó
             autoguardar_chat()
+            return assistant_msg
+        
+        comparados = st.session_state.get("modelos_comparacion", [])
+        if comparados:
+            with st.chat_message("assistant"):
+                if comparar_modelos(cliente, [modelo, *comparados], st.session_state.mensajes, guardar_respuesta):
+                    st.caption(f"{datetime.now().strftime('%H:%M')}")
+        elif RESPUESTA_EN_STREAMING:
+            with st.chat_message("assistant"):
+                if transmitir_respuesta_modelo(cliente, modelo, st.session_state.mensajes, guardar_respuesta):
+                    st.caption(f"{datetime.now().strftime('%H:%M')} • {modelo}"
+                               f"{detalle_respuesta(st.session_state.mensajes[-1])}")
+        else:
+            respuesta, tokens, tiempos = obtener_respuesta_modelo(cliente, modelo, st.session_state.mensajes)
+            if respuesta:
+                assistant_msg = guardar_respuesta(respuesta, tokens, tiempos)
+                with st.chat_message("assistant"):
+                    st.markdown(respuesta)
+                    st.caption(f"{datetime.now().strftime('%H:%M')} • {modelo}{detalle_respuesta(assistant_msg)}")
 
 if __name__ == '__main__':
     ejecutar_chat()
\ No newline at end of file
@@ -0,0 +1,158 @@
+# OCR de imágenes para extractores.py: busca el binario de Tesseract, prepara
+# la imagen (grises, escala, binarización), la corta en franjas que se
+# reconocen en paralelo y recorre todos los cuadros de un GIF o TIFF.
+import functools
+import os
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytesseract
+from PIL import Image, ImageOps, ImageSequence
+
+# Rutas donde suele quedar Tesseract si no está en el PATH
+RUTAS_TESSERACT = (
+    r'C:\Program Files\Tesseract-OCR\tesseract.exe',
+    r'C:\Program Files (x86)\Tesseract-OCR\tesseract.exe',
+    '/opt/homebrew/bin/tesseract',
+    '/usr/local/bin/tesseract',
+    '/usr/bin/tesseract'
+)
+
+# Resolución a la que se lleva cada imagen antes del OCR (Tesseract rinde mejor cerca de 300 DPI)
+# y lado máximo para las imágenes sin DPI declarado
+DPI_OCR = 300
+LADO_MAXIMO_PX = 4000
+# Píxeles por cuadro a partir de los cuales la imagen no se decodifica (una de 200
+# megapíxeles ocupa 600 MB en RGB); los JPEG se decodifican ya reducidos si hace falta
+PIXELES_MAXIMOS = 100_000_000
+# Las imágenes más altas que esto se cortan en franjas por los renglones en blanco
+ALTO_FRANJA_PX = 1200
+# Franjas que se reconocen a la vez: cada una es un proceso de tesseract
+HILOS_OCR = 4
+# Cuadros que se leen como máximo de un GIF o TIFF animado
+MAXIMO_CUADROS = 20
+# Tiempo máximo de OCR de una imagen, con todos sus cuadros y franjas
+TIMEOUT_OCR_SEG = 60
+
+
+@functools.lru_cache(maxsize=None)
+def detectar_tesseract():
+    """Ruta del binario de Tesseract: TESSERACT_CMD, el PATH o una ruta de instalación conocida"""
+    candidatos = [os.environ.get("TESSERACT_CMD"), shutil.which("tesseract"), *RUTAS_TESSERACT]
+    for ruta in candidatos:
+        if ruta and os.path.isfile(ruta):
+            return ruta
+    raise RuntimeError("No se encontró Tesseract OCR: instalarlo o definir la variable TESSERACT_CMD")
+
+
+def preparar_imagen(imagen):
+    """Pasa la imagen a grises sobre fondo blanco, la achica a DPI_OCR y la binariza (Otsu)"""
+    imagen = ImageOps.exif_transpose(imagen)
+    if imagen.mode in ("RGBA", "LA", "P"):
+        imagen = imagen.convert("RGBA")
+        fondo = Image.new("RGBA", imagen.size, "white")
+        imagen = Image.alpha_composite(fondo, imagen)
+    imagen = imagen.convert("L")
+
+    dpi = imagen.info.get("dpi", (0, 0))[0]
+    escala = DPI_OCR / dpi if dpi > DPI_OCR else 1
+    escala = min(escala, LADO_MAXIMO_PX / max(imagen.size))
+    if escala < 1:
+        imagen = imagen.resize((max(1, round(imagen.width * escala)), max(1, round(imagen.height * escala))),
+                               Image.Resampling.LANCZOS)
+
+    umbral = umbral_otsu(imagen.histogram())
+    return imagen.point(lambda p: 255 if p > umbral else 0)
+
+
+def umbral_otsu(histograma):
+    """Nivel de gris que mejor separa tinta de fondo según el histograma"""
+    total = sum(histograma)
+    suma_total = sum(nivel * cantidad for nivel, cantidad in enumerate(histograma))
+    suma_fondo = peso_fondo = 0
+    mejor_umbral, mejor_varianza = 127, -1
+    for nivel, cantidad in enumerate(histograma):
+        peso_fondo += cantidad
+        if peso_fondo == 0:
+            continue
+        peso_frente = total - peso_fondo
+        if peso_frente == 0:
+            break
+        suma_fondo += nivel * cantidad
+        diferencia = suma_fondo / peso_fondo - (suma_total - suma_fondo) / peso_frente
+        varianza = peso_fondo * peso_frente * diferencia * diferencia
+        if varianza > mejor_varianza:
+            mejor_umbral, mejor_varianza = nivel, varianza
+    return mejor_umbral
+
+
+def cortes_en_blanco(imagen, alto=ALTO_FRANJA_PX):
+    """Filas donde cortar la imagen en franjas de ~`alto` px sin partir renglones.
+
+    Cada corte cae en la fila con menos tinta del último cuarto de la franja.
+    """
+    tinta = (np.asarray(imagen) < 128).sum(axis=1)
+    cortes = [0]
+    while imagen.height - cortes[-1] > alto:
+        inicio = cortes[-1] + alto * 3 // 4
+        fin = cortes[-1] + alto
+        cortes.append(inicio + int(np.argmin(tinta[inicio:fin])))
+    cortes.append(imagen.height)
+    return cortes
+
+
+def _reconocer(imagen, limite):
+    restante = limite - time.monotonic()
+    if restante <= 0:
+        raise TimeoutError("el OCR de la imagen superó el tiempo máximo")
+    try:
+        return pytesseract.image_to_string(imagen, timeout=restante)
+    except RuntimeError as e:
+        if "timeout" in str(e).lower():
+            raise TimeoutError("el OCR de la imagen superó el tiempo máximo") from e
+        raise
+
+
+def ocr_cuadro(imagen, limite, grupo):
+    """Texto de un cuadro ya preparado, reconociendo sus franjas en paralelo"""
+    cortes = cortes_en_blanco(imagen)
+    franjas = [imagen.crop((0, arriba, imagen.width, abajo)) for arriba, abajo in zip(cortes, cortes[1:])]
+    if len(franjas) == 1:
+        return _reconocer(franjas[0], limite)
+    return "".join(grupo.map(lambda franja: _reconocer(franja, limite), franjas))
+
+
+def extraer_texto_imagen(archivo, timeout=TIMEOUT_OCR_SEG, avance=None):
+    """OCR de una imagen (todos sus cuadros si es animada); devuelve el texto y los cuadros leídos.
+
+    `avance(cuadros_hechos, cuadros)` se llama después de cada cuadro.
+    """
+    pytesseract.pytesseract.tesseract_cmd = detectar_tesseract()
+    # Las franjas ya van en paralelo: cada tesseract con un solo hilo evita saturar la CPU
+    os.environ.setdefault("OMP_THREAD_LIMIT", "1")
+    limite = time.monotonic() + timeout
+    textos = []
+    with Image.open(archivo) as imagen, ThreadPoolExecutor(max_workers=HILOS_OCR) as grupo:
+        ancho, alto = imagen.size
+        if ancho * alto > PIXELES_MAXIMOS:
+            # Solo hace algo en JPEG: el decodificador reduce la escala a 1/2, 1/4 u 1/8
+            reduccion = next((r for r in (2, 4) if ancho * alto / r ** 2 <= PIXELES_MAXIMOS), 8)
+            imagen.draft("L", (ancho // reduccion, alto // reduccion))
+            if "dpi" in imagen.info:
+                imagen.info["dpi"] = tuple(d * imagen.width / ancho for d in imagen.info["dpi"])
+        if imagen.width * imagen.height > PIXELES_MAXIMOS:
+            raise ValueError(f"la imagen tiene {imagen.width}x{imagen.height} píxeles; "
+                             f"el máximo para OCR es {PIXELES_MAXIMOS // 1_000_000} megapíxeles")
+        cuadros = min(getattr(imagen, "n_frames", 1), MAXIMO_CUADROS)
+        for numero, cuadro in enumerate(ImageSequence.Iterator(imagen)):
+            if numero == cuadros:
+                break
+            texto = ocr_cuadro(preparar_imagen(cuadro.copy()), limite, grupo).strip()
+            # Los GIF suelen repetir el mismo texto en cuadros seguidos
+            if texto and (not textos or textos[-1] != texto):
+                textos.append(texto)
+            if avance:
+                avance(numero + 1, cuadros)
+    return {"contenido": "\n\n".join(textos), "cuadros": cuadros}
@@ -0,0 +1,117 @@
+# Recuperación de fragmentos de los adjuntos: en lugar de mandar al modelo el
+# principio de cada archivo, se lo divide en fragmentos, se los ordena con BM25
+# según la pregunta del usuario y se mandan los mejores que entran en el límite.
+import re
+import unicodedata
+
+import numpy as np
+from scipy import sparse
+
+# Caracteres por fragmento y cuántos comparte cada uno con el anterior, para no
+# cortar una idea justo en el borde
+TAMANO_FRAGMENTO = 1000
+SOLAPE_FRAGMENTO = 150
+# Parámetros usuales de BM25: saturación de la frecuencia y normalización por largo
+BM25_K1 = 1.5
+BM25_B = 0.75
+SEPARADOR_FRAGMENTOS = "\n[...]\n"
+
+
+def palabras(texto):
+    """Términos de un texto: minúsculas, sin acentos"""
+    sin_acentos = unicodedata.normalize("NFKD", texto.lower()).encode("ascii", "ignore").decode("ascii")
+    return re.findall(r"\w+", sin_acentos)
+
+
+def dividir_en_fragmentos(texto, tamano=TAMANO_FRAGMENTO, solape=SOLAPE_FRAGMENTO):
+    """Corta el texto en fragmentos de ~`tamano` caracteres, en un salto de línea o espacio si hay"""
+    fragmentos = []
+    inicio = 0
+    while inicio < len(texto):
+        fin = min(inicio + tamano, len(texto))
+        if fin < len(texto):
+            corte = texto.rfind("\n", inicio + tamano // 2, fin)
+            if corte < 0:
+                corte = texto.rfind(" ", inicio + tamano // 2, fin)
+            if corte > 0:
+                fin = corte + 1
+        fragmentos.append((inicio, texto[inicio:fin]))
+        if fin == len(texto):
+            break
+        inicio = max(fin - solape, inicio + 1)
+    return fragmentos
+
+
+class IndiceBM25:
+    """Índice BM25 en memoria sobre los fragmentos de un texto.
+
+    Los pesos de cada término en cada fragmento se calculan al construirlo y quedan
+    en una matriz dispersa (fragmentos x términos): puntuar una consulta es sumar
+    las columnas de sus términos.
+    """
+
+    def __init__(self, texto):
+        self.texto = texto
+        self.fragmentos = dividir_en_fragmentos(texto)
+        self.vocabulario = {}
+        filas, columnas = [], []
+        for fila, (_, fragmento) in enumerate(self.fragmentos):
+            for termino in palabras(fragmento):
+                filas.append(fila)
+                columnas.append(self.vocabulario.setdefault(termino, len(self.vocabulario)))
+        frecuencias = sparse.csr_matrix(
+            (np.ones(len(filas), dtype=np.float32), (filas, columnas)),
+            shape=(len(self.fragmentos), len(self.vocabulario))
+        )
+        frecuencias.sum_duplicates()
+
+        largos = np.asarray(frecuencias.sum(axis=1)).ravel()
+        documentos_con_termino = np.bincount(frecuencias.indices, minlength=len(self.vocabulario))
+        n = len(self.fragmentos)
+        idf = np.log1p((n - documentos_con_termino + 0.5) / (documentos_con_termino + 0.5))
+        normalizacion = BM25_K1 * (1 - BM25_B + BM25_B * largos / max(largos.mean(), 1))
+        # Fila de cada valor no nulo, para aplicar la normalización de su fragmento
+        filas_valores = np.repeat(np.arange(n), np.diff(frecuencias.indptr))
+        tf = frecuencias.data
+        frecuencias.data = idf[frecuencias.indices] * tf * (BM25_K1 + 1) / (tf + normalizacion[filas_valores])
+        self.pesos = frecuencias.tocsc()
+
+    def puntuar(self, consulta):
+        terminos = [self.vocabulario[t] for t in set(palabras(consulta)) if t in self.vocabulario]
+        if not terminos:
+            return np.zeros(len(self.fragmentos))
+        return np.asarray(self.pesos[:, terminos].sum(axis=1)).ravel()
+
+    def seleccionar(self, consulta, limite_caracteres, enviados=None):
+        """Mejores fragmentos para la consulta que entran en el límite, en el orden del texto.
+
+        Los fragmentos elegidos que se tocan se unen sin repetir el solape. Si ningún
+        término de la consulta aparece en el texto se devuelve el principio.
+        `enviados` es el conjunto de índices de fragmentos que ya se mandaron antes en
+        la conversación: se saltean, se le agregan los elegidos y, si ya tenía alguno,
+        solo se eligen fragmentos donde aparece la consulta (puede no quedar ninguno).
+        """
+        puntajes = self.puntuar(consulta)
+        orden = np.argsort(-puntajes, kind="stable") if puntajes.any() else range(len(self.fragmentos))
+        repetido = bool(enviados)
+        tramos = []
+        usados = 0
+        for indice in orden:
+            if repetido and (indice in enviados or puntajes[indice] <= 0):
+                continue
+            inicio, fragmento = self.fragmentos[indice]
+            if usados + len(fragmento) > limite_caracteres:
+                break
+            tramos.append((inicio, inicio + len(fragmento)))
+            usados += len(fragmento) + len(SEPARADOR_FRAGMENTOS)
+            if enviados is not None:
+                enviados.add(int(indice))
+        if not tramos:
+            return "" if repetido else self.texto[:limite_caracteres]
+        unidos = []
+        for inicio, fin in sorted(tramos):
+            if unidos and inicio <= unidos[-1][1]:
+                unidos[-1][1] = max(unidos[-1][1], fin)
+            else:
+                unidos.append([inicio, fin])
+        return SEPARADOR_FRAGMENTOS.join(self.texto[inicio:fin] for inicio, fin in unidos)
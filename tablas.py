@@ -0,0 +1,181 @@
+# Resumen de archivos tabulares (CSV y Excel) para extractores.py: se leen en
+# bloques, sin tener nunca el archivo entero en memoria, y al modelo se le manda
+# el esquema, la cantidad de filas, estadísticas por columna y una muestra.
+from collections import Counter
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+
+# Filas por bloque y bytes que el lector de pyarrow procesa por vez
+FILAS_POR_BLOQUE = 50_000
+BYTES_POR_BLOQUE_CSV = 4 * 1024 * 1024
+# "pyarrow" (más rápido, con varios hilos) o "c" (el lector de pandas)
+MOTOR_CSV = "pyarrow"
+# Filas de muestra del principio y del final; las tablas de hasta FILAS_TABLA_COMPLETA
+# filas se mandan enteras en lugar de resumidas
+FILAS_MUESTRA = 5
+FILAS_TABLA_COMPLETA = 100
+# Valores distintos que se cuentan por columna de texto antes de dejar de contar
+VALORES_DISTINTOS_MAXIMOS = 1000
+
+
+def bloques_csv(archivo, motor=MOTOR_CSV):
+    """Genera el CSV en DataFrames de a un bloque.
+
+    Con pyarrow se usa su lector incremental; si un bloque no respeta los tipos
+    que infirió con el primero (p. ej. una columna numérica con texto más abajo)
+    se genera None y se vuelve a leer desde el principio con el lector por
+    bloques de pandas.
+    """
+    if motor == "pyarrow":
+        inicio = archivo.tell()
+        entregados = 0
+        try:
+            lector = pa_csv.open_csv(archivo, read_options=pa_csv.ReadOptions(block_size=BYTES_POR_BLOQUE_CSV))
+            nombres = lector.schema.names
+            # pandas renombra las columnas repetidas (a, a.1); pyarrow no, así que las deja para pandas
+            if len(set(nombres)) == len(nombres):
+                for lote in lector:
+                    entregados += 1
+                    yield lote.to_pandas()
+                return
+        except pa.ArrowInvalid:
+            pass
+        archivo.seek(inicio)
+        if entregados:
+            # Avisa que los bloques ya entregados se descartan y se vuelve a empezar
+            yield None
+    yield from pd.read_csv(archivo, chunksize=FILAS_POR_BLOQUE)
+
+
+def bloques_excel(archivo, maximo_filas=None):
+    """Genera la primera hoja de un .xlsx en DataFrames, leyéndola en modo streaming.
+
+    Con `maximo_filas` se detiene después de esa cantidad de filas de datos.
+    """
+    # openpyxl solo hace falta para planillas: los CSV no lo importan
+    from openpyxl import load_workbook
+    libro = load_workbook(archivo, read_only=True, data_only=True)
+    try:
+        filas = libro.worksheets[0].iter_rows(values_only=True, max_row=maximo_filas + 1 if maximo_filas else None)
+        encabezado = next(filas, None)
+        if encabezado is None:
+            return
+        columnas = [str(c) if c is not None else f"Unnamed: {i}" for i, c in enumerate(encabezado)]
+        bloque = []
+        for fila in filas:
+            bloque.append(fila[:len(columnas)])
+            if len(bloque) == FILAS_POR_BLOQUE:
+                yield pd.DataFrame(bloque, columns=columnas).infer_objects()
+                bloque = []
+        if bloque:
+            yield pd.DataFrame(bloque, columns=columnas).infer_objects()
+    finally:
+        libro.close()
+
+
+class ResumenTabla:
+    """Acumula, bloque a bloque, lo necesario para describir una tabla sin guardarla"""
+
+    def __init__(self):
+        self.filas = 0
+        self.columnas = None
+        self.tipos = {}
+        self.nulos = Counter()
+        self.numericas = {}
+        self.frecuencias = {}
+        self.cabeza = None
+        self.cola = None
+
+    def agregar(self, bloque):
+        if self.columnas is None:
+            self.columnas = list(bloque.columns)
+        # Cada bloque numera sus filas desde 0; la muestra muestra la posición en el archivo
+        bloque.index = pd.RangeIndex(self.filas, self.filas + len(bloque))
+        self.filas += len(bloque)
+        limite_cabeza = FILAS_TABLA_COMPLETA + 1
+        if self.cabeza is None:
+            self.cabeza = bloque.head(limite_cabeza)
+        elif len(self.cabeza) < limite_cabeza:
+            self.cabeza = pd.concat([self.cabeza, bloque.head(limite_cabeza - len(self.cabeza))])
+        self.cola = pd.concat([self.cola, bloque.tail(FILAS_MUESTRA)]).tail(FILAS_MUESTRA) \
+            if self.cola is not None else bloque.tail(FILAS_MUESTRA)
+
+        for columna in self.columnas:
+            serie = bloque[columna]
+            self.tipos.setdefault(columna, set()).add(str(serie.dtype))
+            self.nulos[columna] += int(serie.isna().sum())
+            if pd.api.types.is_numeric_dtype(serie) and not pd.api.types.is_bool_dtype(serie):
+                self._agregar_numerica(columna, serie.dropna())
+            elif pd.api.types.is_datetime64_any_dtype(serie):
+                self._agregar_numerica(columna, serie.dropna(), solo_extremos=True)
+            else:
+                self._agregar_frecuencias(columna, serie.dropna())
+
+    def _agregar_numerica(self, columna, serie, solo_extremos=False):
+        if serie.empty:
+            return
+        estado = self.numericas.setdefault(columna, {"n": 0, "suma": 0.0, "min": None, "max": None,
+                                                     "solo_extremos": solo_extremos})
+        minimo, maximo = serie.min(), serie.max()
+        estado["min"] = minimo if estado["min"] is None else min(estado["min"], minimo)
+        estado["max"] = maximo if estado["max"] is None else max(estado["max"], maximo)
+        estado["n"] += len(serie)
+        if not solo_extremos:
+            estado["suma"] += float(serie.sum())
+
+    def _agregar_frecuencias(self, columna, serie):
+        frecuencias = self.frecuencias.setdefault(columna, Counter())
+        if frecuencias is None:
+            return
+        frecuencias.update(serie.astype(str).value_counts().to_dict())
+        if len(frecuencias) > VALORES_DISTINTOS_MAXIMOS:
+            self.frecuencias[columna] = None
+
+    def _describir_columna(self, columna):
+        partes = [f"nulos {self.nulos[columna]}"]
+        if columna in self.numericas:
+            estado = self.numericas[columna]
+            partes.append(f"mín {estado['min']}, máx {estado['max']}")
+            if not estado["solo_extremos"]:
+                partes.append(f"media {estado['suma'] / estado['n']:.4g}")
+        elif columna in self.frecuencias and self.frecuencias[columna] is None:
+            partes.append(f"más de {VALORES_DISTINTOS_MAXIMOS} valores distintos")
+        elif self.frecuencias.get(columna):
+            frecuencias = self.frecuencias[columna]
+            frecuentes = ", ".join(f"{valor} ({veces})" for valor, veces in frecuencias.most_common(3))
+            partes.append(f"{len(frecuencias)} valores distintos; frecuentes: {frecuentes}")
+        return ", ".join(partes)
+
+    def texto(self, titulo):
+        if self.columnas is None:
+            return f"{titulo}: tabla vacía"
+        lineas = [f"{titulo}: {self.filas} filas x {len(self.columnas)} columnas", "Columnas:"]
+        for columna in self.columnas:
+            lineas.append(f"- {columna} ({'/'.join(sorted(self.tipos[columna]))}): {self._describir_columna(columna)}")
+        if self.filas <= FILAS_TABLA_COMPLETA:
+            lineas += ["Tabla completa:", self.cabeza.to_string()]
+        else:
+            lineas += [f"Primeras {FILAS_MUESTRA} filas:", self.cabeza.head(FILAS_MUESTRA).to_string(),
+                       f"Últimas {FILAS_MUESTRA} filas:", self.cola.to_string()]
+        return "\n".join(lineas)
+
+    def vista(self):
+        return (self.cabeza if self.cabeza is not None else pd.DataFrame()).head().to_json(orient="split")
+
+
+def resumir_tabla(bloques, titulo, avance=None):
+    """Resume una tabla leída por bloques; devuelve el texto para el modelo y la vista previa.
+
+    `avance(filas, None)` se llama después de cada bloque.
+    """
+    resumen = ResumenTabla()
+    for bloque in bloques:
+        if bloque is None:
+            resumen = ResumenTabla()
+            continue
+        resumen.agregar(bloque)
+        if avance:
+            avance(resumen.filas, None)
+    return {"contenido": resumen.texto(titulo), "vista": resumen.vista()}